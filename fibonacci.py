@@ -1,38 +1,198 @@
-import timeit
-from units.redis_lru import *
+import argparse
+import datetime
+import functools
+import json
+import platform
+import random
+import sys
+import time
 
-client = redis.Redis(host="localhost", port=6379)
-cache = MyLRU(client, max_size=512, clear_on_start=True)
+import redis
 
+from units.redis_lru import MyLRU
 
-def fibonacci(n):
-    if n <= 0:
-        return 0
-    elif n == 1:
-        return 1
-    else:
-        return fibonacci(n - 1) + fibonacci(n - 2)
+MAX_SIZE = 512
 
 
-@cache
-def fibonacci_cache(n):
-    if n <= 0:
-        return 0
-    elif n == 1:
-        return 1
-    else:
-        return fibonacci_cache(n - 1) + fibonacci_cache(n - 2)
+def make_fibonacci(decorate):
+    """Рекурсивне число Фібоначчі, рекурсивні виклики якого проходять через decorate"""
+    @decorate
+    def fibonacci(n):
+        if n <= 0:
+            return 0
+        elif n == 1:
+            return 1
+        else:
+            return fibonacci(n - 1) + fibonacci(n - 2)
 
+    return fibonacci
+
+
+def make_fibonacci_loop(decorate):
+    """Ітеративне число Фібоначчі: промах коштує мало, тож видно накладні витрати кешу"""
+    @decorate
+    def fibonacci_loop(n):
+        previous, current = 0, 1
+        for _ in range(n):
+            previous, current = current, previous + current
+        return previous
+
+    return fibonacci_loop
+
+
+def no_cache(client):
+    return lambda func: func, lambda: None
+
+
+def functools_cache(client):
+    decorated = []
+
+    def decorate(func):
+        decorated.append(functools.lru_cache(maxsize=MAX_SIZE)(func))
+        return decorated[-1]
+
+    return decorate, lambda: [func.cache_clear() for func in decorated]
+
+
+def my_lru(client):
+    cache = MyLRU(client, max_size=MAX_SIZE, key_prefix='FibonacciBench')
+    # Прибирання без фонового потоку: його команди не потрапляють у вимірюваний виклик
+    return cache, lambda: cache.clear(background=False)
+
+
+STRATEGIES = {'none': no_cache, 'functools': functools_cache, 'MyLRU': my_lru}
+
+
+def hit_heavy(rng, calls):
+    """Повторні виклики з невеликого набору аргументів, кеш прогрітий"""
+    arguments = rng.choices(range(10, 20), k=calls)
+    return make_fibonacci, range(10, 20), [(n,) for n in arguments]
+
+
+def miss_heavy(rng, calls):
+    """Кожен виклик з новим аргументом"""
+    arguments = rng.sample(range(2 * calls), calls)
+    return make_fibonacci_loop, (), [(n,) for n in arguments]
 
-if __name__ == '__main__':
 
-    start_time = timeit.default_timer()
-    n = 38
-    print(f'fibonacci({n}) -> {fibonacci(n)}')
-    print(f'Duration without LRU cache: {timeit.default_timer() - start_time} sec')
+def recursive(rng, calls, n=22):
+    """Обчислення fibonacci(n) з порожнього кешу; кеш очищується перед кожним викликом"""
+    return make_fibonacci, (), [(n,)] * calls
 
-    start_time = timeit.default_timer()
-    n = 380
-    print(f'fibonacci({n}) -> {fibonacci_cache(n)}')
-    print(f'Duration with LRU cache: {timeit.default_timer() - start_time} sec')
 
+# Назва: (побудова навантаження, кількість вимірюваних викликів, чи очищати кеш перед кожним)
+WORKLOADS = {
+    'hit-heavy': (hit_heavy, 2000, False),
+    'miss-heavy': (miss_heavy, 2000, False),
+    'recursive': (recursive, 20, True),
+}
+
+
+def redis_commands(client):
+    """Загальна кількість виконаних сервером команд або None, якщо сервер не підтримує INFO"""
+    try:
+        return sum(stats['calls'] for stats in client.info('commandstats').values())
+    except redis.ResponseError:
+        return None
+
+
+def percentile(latencies, fraction):
+    ordered = sorted(latencies)
+    return ordered[min(int(fraction * len(ordered)), len(ordered) - 1)]
+
+
+def run(client, workload, strategy, seed=1, scale=1.0):
+    """Виконує одне навантаження з однією стратегією кешування і повертає рядок результатів"""
+    build, calls, reset_each = WORKLOADS[workload]
+    make, warm_up, calls_args = build(random.Random(seed), max(int(calls * scale), 1))
+    decorate, reset = STRATEGIES[strategy](client)
+    reset()
+    func = make(decorate)
+    for n in warm_up:
+        func(n)
+
+    latencies, commands = [], 0
+    for args in calls_args:
+        if reset_each:
+            reset()
+        commands_before = redis_commands(client)
+        start = time.perf_counter_ns()
+        func(*args)
+        latencies.append(time.perf_counter_ns() - start)
+        if commands_before is None:
+            commands = None
+        else:
+            # Сам INFO теж рахується сервером як команда
+            commands += redis_commands(client) - commands_before - 1
+    reset()
+
+    return {
+        'workload': workload,
+        'strategy': strategy,
+        'calls': len(calls_args),
+        'ops_per_sec': round(len(calls_args) * 1e9 / sum(latencies), 1),
+        'p50_us': round(percentile(latencies, 0.5) / 1e3, 2),
+        'p99_us': round(percentile(latencies, 0.99) / 1e3, 2),
+        'redis_commands_per_call': None if commands is None else commands / len(calls_args),
+    }
+
+
+def connect(url, fake=False):
+    """Клієнт до redis-server за url або, якщо сервер недоступний, до fakeredis у процесі"""
+    if not fake:
+        client = redis.Redis.from_url(url)
+        try:
+            client.ping()
+            return client, 'redis-server'
+        except redis.ConnectionError:
+            print(f'Redis at {url} is unavailable, using fakeredis', file=sys.stderr)
+    try:
+        import fakeredis
+    except ImportError:
+        sys.exit('Redis is unavailable and fakeredis is not installed (pip install "fakeredis[lua]")')
+    return fakeredis.FakeRedis(), 'fakeredis'
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Benchmark of MyLRU against functools.lru_cache and no cache')
+    parser.add_argument('--redis', default='redis://localhost:6379/0', help='Redis URL')
+    parser.add_argument('--fake', action='store_true', help='use in-process fakeredis instead of redis-server')
+    parser.add_argument('--workload', action='append', choices=WORKLOADS, help='workloads to run (default all)')
+    parser.add_argument('--strategy', action='append', choices=STRATEGIES, help='strategies to run (default all)')
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--scale', type=float, default=1.0, help='multiplier for the number of calls')
+    parser.add_argument('--json', metavar='PATH', help='write results as JSON to PATH ("-" for stdout)')
+    options = parser.parse_args(argv)
+
+    client, backend = connect(options.redis, options.fake)
+    results = [run(client, workload, strategy, options.seed, options.scale)
+               for workload in options.workload or WORKLOADS
+               for strategy in options.strategy or STRATEGIES]
+
+    print(f'{"workload":11} {"strategy":10} {"ops/sec":>12} {"p50 us":>10} {"p99 us":>10} {"cmds/call":>10}',
+          file=sys.stderr)
+    for row in results:
+        commands = row['redis_commands_per_call']
+        print(f'{row["workload"]:11} {row["strategy"]:10} {row["ops_per_sec"]:12.1f} {row["p50_us"]:10.2f} '
+              f'{row["p99_us"]:10.2f} {"-" if commands is None else f"{commands:.2f}":>10}', file=sys.stderr)
+
+    if options.json:
+        report = {
+            'timestamp': datetime.datetime.now(datetime.timezone.utc).isoformat(timespec='seconds'),
+            'python': platform.python_version(),
+            'redis_py': redis.__version__,
+            'backend': backend,
+            'seed': options.seed,
+            'scale': options.scale,
+            'results': results,
+        }
+        if options.json == '-':
+            json.dump(report, sys.stdout, indent=2)
+            print()
+        else:
+            with open(options.json, 'w') as file:
+                json.dump(report, file, indent=2)
+
+
+if __name__ == '__main__':
+    main()
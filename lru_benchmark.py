@@ -0,0 +1,292 @@
+import multiprocessing
+import random
+import sys
+import threading
+import time
+import timeit
+from concurrent.futures import ThreadPoolExecutor
+from units.redis_lru import *
+
+client = redis.Redis(host="localhost", port=6379)
+
+
+def fill(cache: MyLRU, fn: CachedFunction, size, chunk_size=10_000):
+    """Заповнює кеш size записами fn(0..size-1) пакетами через pipeline"""
+    for start in range(0, size, chunk_size):
+        pipe = cache.client.pipeline(transaction=False)
+        mapping, sizes = {}, {}
+        for index in range(start, min(start + chunk_size, size)):
+            key, data = fn.make_key(index), fn.encode(index)
+            pipe.set(key, data)
+            mapping[key], sizes[key] = index, len(data)
+        pipe.zadd(cache.lru_key, mapping)
+        pipe.hset(cache.sizes_key, mapping=sizes)
+        pipe.incrby(cache.bytes_key, sum(sizes.values()))
+        pipe.execute()
+    cache.client.set(cache.clock_key, size)
+
+
+def hit_latency(size, repeats=1000):
+    cache = MyLRU(client, max_size=size, key_prefix='HitLatencyBench')
+    cache.clear(background=False)
+
+    @cache
+    def identity(n):
+        return n
+
+    # Перший виклик отримує токен версії, з яким fill() будує ключі
+    identity(0)
+    fill(cache, cache._function(identity), size)
+    latency = timeit.timeit(lambda: identity(0), number=repeats) / repeats
+    # Записи старої епохи прибираються, тож заповнення не лишається в Redis
+    cache.clear(background=False)
+    return latency
+
+
+def lookup(name, data, weight, tags, extra=None):
+    pass
+
+
+def _shared_call(url, args):
+    # Процес створюється через spawn, тому має власний PYTHONHASHSEED
+    cached_lookup = MyLRU(redis.Redis.from_url(url), key_prefix='SharedKeysBench')(lookup)
+    cached_lookup(*args)
+    return cached_lookup.stats().get('misses', 0)
+
+
+def keys_are_shared(processes=4, url='redis://localhost:6379/0'):
+    """Перевіряє, що процеси влучають у записи одне одного: промахується лише перший"""
+    MyLRU(redis.Redis.from_url(url), key_prefix='SharedKeysBench').clear(background=False)
+    args = ('contact', b'bytes', 3.5, frozenset({'a', 'b'}), {'x': (1, None)})
+    # maxtasksperchild=1 - кожен виклик у новому процесі
+    with multiprocessing.get_context('spawn').Pool(processes, maxtasksperchild=1) as pool:
+        misses = [pool.apply(_shared_call, (url, args)) for _ in range(processes)]
+    return misses == [1] + [0] * (processes - 1)
+
+
+def single_flight_executions(threads=16):
+    """Скільки разів виконується функція при одночасному промаху в threads потоках"""
+    cache = MyLRU(client, max_size=1024, key_prefix='SingleFlightBench', single_flight=True)
+    executions = []
+
+    @cache
+    def slow(n):
+        executions.append(n)
+        time.sleep(0.5)
+        return n
+
+    barrier = threading.Barrier(threads)
+    # Новий аргумент при кожному запуску, щоб усі потоки отримали промах
+    argument = time.time_ns()
+
+    def worker():
+        barrier.wait()
+        slow(argument)
+
+    workers = [threading.Thread(target=worker) for _ in range(threads)]
+    for thread in workers:
+        thread.start()
+    for thread in workers:
+        thread.join()
+    return len(executions)
+
+
+async def async_oversized_skipped(async_client, max_value_bytes=50):
+    """Перевіряє, що AsyncMyLRU повертає значення понад max_value_bytes, не записуючи його"""
+    cache = AsyncMyLRU(async_client, key_prefix='OversizedBench', max_value_bytes=max_value_bytes)
+    await cache.clear()
+
+    @cache
+    async def payload(n):
+        return b'x' * n
+
+    results = [await payload(2 * max_value_bytes) for _ in range(2)]
+    return (all(result == b'x' * 2 * max_value_bytes for result in results)
+            and payload.stats()['misses'] == 2 and not await cache.client.zcard(cache.lru_key))
+
+
+def batch_vs_loop(size=10_000):
+    """Час пакетного map() і циклу одиночних викликів для size ключів: промахи, потім влучання"""
+    cache = MyLRU(client, max_size=4 * size, key_prefix='BatchBench')
+
+    @cache
+    def square(n):
+        return n * n
+
+    offset = time.time_ns()
+    loop_keys, batch_keys = range(offset, offset + size), range(offset + size, offset + 2 * size)
+    for title, keys in (('miss', loop_keys), ('hit', loop_keys)):
+        loop_time = timeit.timeit(lambda: [square(n) for n in keys], number=1)
+        print(f'Loop of {size} single calls ({title}): {loop_time:.3f} sec')
+    for title, keys in (('miss', batch_keys), ('hit', batch_keys)):
+        batch_time = timeit.timeit(lambda: square.map(keys), number=1)
+        print(f'map() over {size} keys ({title}): {batch_time:.3f} sec')
+
+
+def shard_balance(ports=(6379, 6380, 6381), size=30_000):
+    """Розподіл записів між локальними redis-server на різних портах"""
+    clients = [redis.Redis(host='localhost', port=port) for port in ports]
+    cache = ShardedMyLRU(clients, max_size=2 * size, key_prefix='ShardBench', clear_on_start=True)
+
+    @cache
+    def square(n):
+        return n * n
+
+    square.map(range(size))
+    for name, load in cache.shard_stats().items():
+        print(f'Shard {name}: {load["entries"]} entries, {load["bytes"]} bytes, {load["calls"]} calls')
+
+
+def moved_on_new_node(nodes=3, keys=100_000):
+    """Частка ключів, що змінюють вузол при додаванні ще одного вузла"""
+    before = HashRing([f'node{index}' for index in range(nodes)])
+    after = HashRing([f'node{index}' for index in range(nodes + 1)])
+    moved = sum(before.node(str(key)) != after.node(str(key)) for key in range(keys))
+    return moved / keys
+
+
+PAYLOADS = {
+    'fibonacci': list(range(1000)),
+    'contacts': [{'name': f'User {i}', 'phones': [f'+38050{i:07d}'], 'emails': [f'user{i}@mail.com'],
+                  'address': 'Kyiv, Khreshchatyk street 1'} for i in range(500)],
+    'text': ' '.join(['lorem ipsum dolor sit amet'] * 2000),
+}
+
+
+def codec_report(repeats=200):
+    """Розмір збереженого значення і час декодування для кожного кодека"""
+    for name, payload in PAYLOADS.items():
+        for codec in CODECS:
+            for compress in (None, *COMPRESSORS):
+                data = encoder(codec, compress)(payload)
+                decode_time = timeit.timeit(lambda: decode(data), number=repeats) / repeats
+                print(f'{name:10} {codec:8} {compress or "-":5} {len(data):8} bytes '
+                      f'{decode_time * 1e6:9.1f} us')
+
+
+def stress_worker(square, threads, calls, keys, seed):
+    """Викликає square з threads потоків, зрідка інвалідуючи її; повертає кількість хибних результатів"""
+    rng = random.Random(seed)
+    arguments = [rng.randrange(keys) for _ in range(calls)]
+
+    def check(n):
+        if rng.random() < 0.001:
+            square.invalidate()
+        if rng.random() < 0.01:
+            return sum(result != m * m for m, result in zip(range(n, n + 10), square.map(range(n, n + 10))))
+        return square(n) != n * n
+
+    with ThreadPoolExecutor(threads) as executor:
+        return sum(executor.map(check, arguments))
+
+
+def stress(url='redis://localhost:6379/0', processes=4, threads=8, calls=20_000, keys=2_000, max_size=500):
+    """Навантажує один кеш з processes процесів по threads потоків і перевіряє інваріанти в Redis.
+
+    Процеси створюються через fork після створення кешу, тож перевіряється і успадкування
+    пулу з'єднань, L1 та підписки на інвалідацію.
+    """
+    cache = MyLRU.from_url(url, max_size=max_size, key_prefix='StressBench', clear_on_start=True,
+                           l1_size=100, single_flight=True)
+
+    @cache
+    def square(n):
+        return n * n
+
+    def run(seed):
+        sys.exit(1 if stress_worker(square, threads, calls, keys, seed) else 0)
+
+    context = multiprocessing.get_context('fork')
+    workers = [context.Process(target=run, args=(seed,)) for seed in range(processes)]
+    start = time.perf_counter()
+    for worker in workers:
+        worker.start()
+    wrong = stress_worker(square, threads, calls, keys, processes)
+    for worker in workers:
+        worker.join()
+    elapsed = time.perf_counter() - start
+    failed = sum(worker.exitcode != 0 for worker in workers)
+    print(f'{(processes + 1) * calls} calls in {elapsed:.1f} sec: {wrong} wrong results in parent, '
+          f'{failed} of {processes} child processes failed')
+    cache.cleanup(background=False)
+    violations = cache.check_invariants()
+    print(f'Invariant violations: {violations or "none"}')
+    return not wrong and not failed and not violations
+
+
+def zipf_trace(length, keys, skew=1.0, seed=1):
+    """Послідовність звернень до keys ключів з розподілом Ципфа"""
+    weights = list(itertools.accumulate(1 / (rank + 1) ** skew for rank in range(keys)))
+    return random.Random(seed).choices(range(keys), cum_weights=weights, k=length)
+
+
+def scan_trace(length, keys, scan_every=1000, scan_size=2000, seed=1):
+    """Траса Ципфа, перемежована разовими проходами по scan_size нових ключів"""
+    trace, scans = [], itertools.count(keys)
+    for start in range(0, length, scan_every):
+        trace.extend(zipf_trace(scan_every, keys, seed=seed + start))
+        trace.extend(next(scans) for _ in range(scan_size))
+    return trace
+
+
+def simulate(trace, max_size, admission=False):
+    """Частка влучань LRU з max_size записів на трасі; з admission — з фільтром TinyLFU"""
+    entries, hits = OrderedDict(), 0
+    sketch = CountMinSketch(max_size) if admission else None
+    for key in trace:
+        if sketch is not None:
+            sketch.increment(key)
+        if key in entries:
+            entries.move_to_end(key)
+            hits += 1
+            continue
+        if len(entries) >= max_size:
+            victim = next(iter(entries))
+            if sketch is not None and not sketch.admit(key, victim):
+                continue
+            del entries[victim]
+        entries[key] = None
+    return hits / len(trace)
+
+
+def cache_hit_ratio(redis_client, trace, max_size, admission=False):
+    """Частка влучань MyLRU з max_size записів на трасі; з admission - з допуском TinyLFU у Redis"""
+    cache = MyLRU(redis_client, max_size=max_size, key_prefix='AdmissionBench', admission=admission)
+    cache.clear(background=False)
+
+    @cache
+    def identity(n):
+        return n
+
+    for key in trace:
+        identity(key)
+    hit_ratio = identity.stats()['hit_ratio']
+    cache.clear(background=False)
+    return hit_ratio
+
+
+def admission_report(redis_client=client, max_size=1000, keys=100_000, length=200_000):
+    """Частка влучань простого LRU і LRU з допуском TinyLFU при однаковому max_size:
+    модель у пам'яті і сам MyLRU(admission=True) на тій самій трасі
+    """
+    traces = {'zipf': zipf_trace(length, keys), 'zipf+scan': scan_trace(length, keys)}
+    for name, trace in traces.items():
+        lru, tiny_lfu = simulate(trace, max_size), simulate(trace, max_size, admission=True)
+        print(f'{name:10} max_size={max_size} model: LRU {lru:.1%}, TinyLFU {tiny_lfu:.1%}')
+        lru, tiny_lfu = (cache_hit_ratio(redis_client, trace, max_size, admission) for admission in (False, True))
+        print(f'{name:10} max_size={max_size} MyLRU: LRU {lru:.1%}, TinyLFU {tiny_lfu:.1%}')
+
+
+if __name__ == '__main__':
+    print(f'Stress test passed: {stress()}')
+    admission_report()
+    codec_report()
+    print(f'Executions for 16 concurrent misses: {single_flight_executions()}')
+    print(f'Oversized values skipped by AsyncMyLRU: '
+          f'{asyncio.run(async_oversized_skipped(redis.asyncio.Redis(host="localhost", port=6379)))}')
+    batch_vs_loop()
+    print(f'Keys moved when adding a 4th node: {moved_on_new_node():.1%}')
+    shard_balance()
+    print(f'Keys are shared between processes: {keys_are_shared()}')
+    for size in (1_000, 100_000, 1_000_000):
+        print(f'Hit latency with {size} entries: {hit_latency(size) * 1e6:.1f} us')
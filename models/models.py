@@ -1,25 +1,201 @@
 from mongoengine import *
-from datetime import date
+from mongoengine.connection import get_db
+from pymongo import ReturnDocument, UpdateOne
+from calendar import isleap
+import os
+import re
+import threading
+from datetime import date, timedelta
 
 connect(host='mongodb://localhost:27017/assistant')
 
+# Скільки документів курсор отримує від сервера за один запит у списках
+BATCH_SIZE = 1000
+
+
+def raw_view(queryset, fields, batch_size=None):
+    """Курсор словників лише з полями fields: без побудови Document для кожного запису"""
+    return queryset.only(*fields).as_pymongo().batch_size(batch_size or BATCH_SIZE)
+
+
+def birthday_key(day: date) -> int:
+    """Місяць і день як одне число MMDD: порядок ключів збігається з порядком днів у році"""
+    return day.month * 100 + day.day
+
+
+def birthday_in_year(birthday: date, year: int) -> date:
+    # 29 лютого в невисокосний рік святкуємо 28 лютого
+    if birthday.month == 2 and birthday.day == 29 and not isleap(year):
+        return date(year, 2, 28)
+    return date(year, birthday.month, birthday.day)
+
+
+def search_tokens(*values) -> list:
+    """Токени пошуку для значень: триграми всього значення і префікси з 1-2 символів кожного слова.
+
+    Триграми дають кандидатів для пошуку підрядка від 3 символів, префікси - для коротших запитів
+    """
+    tokens = set()
+    for value in values:
+        value = value.lower().lstrip('+')
+        tokens.update(value[index:index + 3] for index in range(len(value) - 2))
+        for word in re.findall(r'\w+', value):
+            tokens.update((word[:1], word[:2]))
+    return sorted(tokens)
+
+
+def query_tokens(query: str) -> list:
+    query = query.lower().lstrip('+')
+    if len(query) < 3:
+        return [query]
+    return sorted({query[index:index + 3] for index in range(len(query) - 2)})
+
 
 class Contacts(Document):
     name = StringField(max_length=30, unique=True, required=True)
     address = StringField(max_length=100)
     birthday = DateField()
+    # birthday_key(birthday) або 0 без дня народження; підтримується в clean()
+    birthday_key = IntField()
     phones = ListField(StringField(max_length=15, unique=True))
     emails = ListField(StringField(max_length=254, unique=True))
+    # search_tokens(name, *phones, *emails); надмножина: зайві токени лише додають кандидатів,
+    # яких відкидає перевірка підрядка в search()
+    search_tokens = ListField(StringField())
+
+    # Поля, які потрібні для показу контакту
+    VIEW_FIELDS = ('name', 'address', 'birthday', 'phones', 'emails')
+
+    # Телефон і email унікальні серед усіх контактів. Часткові індекси не враховують контакти
+    # з порожнім списком, інакше всі вони конфліктували б між собою
+    meta = {'indexes': ['birthday_key', 'search_tokens',
+                        {'fields': ['phones'], 'unique': True, 'partialFilterExpression': {'phones': {'$type': 'string'}}},
+                        {'fields': ['emails'], 'unique': True, 'partialFilterExpression': {'emails': {'$type': 'string'}}}]}
+
+    def clean(self):
+        self.birthday_key = birthday_key(self.birthday) if self.birthday else 0
+        self.search_tokens = search_tokens(self.name, *self.phones, *self.emails)
+
+    @classmethod
+    def search(cls, query: str, page=1, page_size=30) -> tuple:
+        """Сторінка контактів (словників з VIEW_FIELDS), у імені, телефоні або email яких є query,
+        найрелевантніші першими, і чи є наступна сторінка.
+
+        Кандидатів дає індекс search_tokens, підрядок перевіряється на сервері для них.
+        Запит з 1-2 символів знаходить контакти, в яких так починається якесь слово.
+        Порядок: ім'я збігається, ім'я починається з query, ім'я містить query, решта; далі за ім'ям.
+        """
+        pattern = re.escape(query)
+        match = {'search_tokens': {'$all': query_tokens(query)},
+                 '$or': [{field: {'$regex': pattern, '$options': 'i'}} for field in ('name', 'phones', 'emails')]}
+        rank = {'$switch': {'branches': [
+            {'case': {'$regexMatch': {'input': '$name', 'regex': f'^{pattern}$', 'options': 'i'}}, 'then': 0},
+            {'case': {'$regexMatch': {'input': '$name', 'regex': f'^{pattern}', 'options': 'i'}}, 'then': 1},
+            {'case': {'$regexMatch': {'input': '$name', 'regex': pattern, 'options': 'i'}}, 'then': 2},
+        ], 'default': 3}}
+        pipeline = [{'$match': match}, {'$addFields': {'rank': rank}}, {'$sort': {'rank': 1, 'name': 1}},
+                    {'$skip': (page - 1) * page_size}, {'$limit': page_size + 1},
+                    {'$project': {field: 1 for field in cls.VIEW_FIELDS}}]
+        # Зайвий запис показує, чи є наступна сторінка, без окремого підрахунку
+        contacts = list(cls.objects.aggregate(pipeline))
+        return contacts[:page_size], len(contacts) > page_size
+
+    @classmethod
+    def migrate_search_tokens(cls, batch_size=1000) -> int:
+        """Будує search_tokens контактам, збереженим до його появи; повертає кількість оновлених"""
+        collection, requests, updated = cls._get_collection(), [], 0
+        fields = {'name': 1, 'phones': 1, 'emails': 1}
+        for document in collection.find({'search_tokens': None}, fields, batch_size=batch_size):
+            tokens = search_tokens(document['name'], *document.get('phones', []), *document.get('emails', []))
+            requests.append(UpdateOne({'_id': document['_id']}, {'$set': {'search_tokens': tokens}}))
+            if len(requests) >= batch_size:
+                updated += collection.bulk_write(requests, ordered=False).modified_count
+                requests = []
+        if requests:
+            updated += collection.bulk_write(requests, ordered=False).modified_count
+        return updated
 
     def days_to_birthday(self) -> int:
         if self.birthday is None:
             return -1
         this_day = date.today()
-        birthday_day = date(this_day.year, self.birthday.month, self.birthday.day)
+        birthday_day = birthday_in_year(self.birthday, this_day.year)
         if birthday_day < this_day:
-            birthday_day = date(this_day.year + 1, self.birthday.month, self.birthday.day)
+            birthday_day = birthday_in_year(self.birthday, this_day.year + 1)
         return int((birthday_day - this_day).days)
 
+    @classmethod
+    def birthdays_within(cls, days: int, today: date = None) -> list:
+        """Запити контактів з днем народження в найближчі days днів.
+
+        Кожен запит - діапазон індексу birthday_key, відсортований за ним; разом вони
+        дають контакти в порядку днів, що залишилися. При переході через Новий рік
+        запитів два: до кінця року і з 1 січня.
+        """
+        if days < 0:
+            return []
+        today = today or date.today()
+        start = birthday_key(today)
+        if days >= 365:
+            ranges = [(start, 1231), (101, start - 1)]
+        else:
+            last_day = today + timedelta(days=days)
+            end = birthday_key(last_day)
+            if end == 228 and not isleap(last_day.year):
+                end = 229
+            ranges = [(start, end)] if start <= end else [(start, 1231), (101, end)]
+        return [cls.objects(birthday_key__gte=low, birthday_key__lte=high).order_by('birthday_key')
+                for low, high in ranges if low <= high]
+
+    @classmethod
+    def migrate_birthday_keys(cls) -> int:
+        """Заповнює birthday_key контактам, збереженим до його появи; повертає кількість оновлених"""
+        result = cls._get_collection().update_many({'birthday_key': None}, [{'$set': {'birthday_key': {
+            '$cond': [{'$ifNull': ['$birthday', False]},
+                      {'$add': [{'$multiply': [{'$month': '$birthday'}, 100]}, {'$dayOfMonth': '$birthday'}]},
+                      0]}}}])
+        return result.modified_count
+
+
+class IdBlocks:
+    """Видача значень SequenceField блоками (hi/lo).
+
+    Один запит до лічильника mongoengine.counters резервує щонайменше block_size значень,
+    далі вони видаються з пам'яті. Значення унікальні й зростають у межах процесу; блоки
+    різних процесів не перетинаються, а невикористаний залишок блоку лишається пропуском.
+    """
+
+    def __init__(self, document, field='_id', block_size=100):
+        self.document = document
+        self.field = field
+        self.block_size = block_size
+        self.next_id, self.last_id = 1, 0
+        self.lock = threading.Lock()
+        self.pid = os.getpid()
+
+    def reserve(self, count) -> range:
+        """Резервує count значень одним запитом, оминаючи локальний блок"""
+        field = self.document._fields[self.field]
+        counter = get_db(alias=field.db_alias)[field.collection_name].find_one_and_update(
+            {'_id': f'{field.get_sequence_name()}.{field.name}'}, {'$inc': {'next': count}},
+            return_document=ReturnDocument.AFTER, upsert=True)
+        return range(counter['next'] - count + 1, counter['next'] + 1)
+
+    def take(self, count=1) -> list:
+        """count нових значень; запит до бази лише коли локальний блок вичерпано"""
+        if count < 1:
+            return []
+        with self.lock:
+            if self.pid != os.getpid():
+                # Блок, успадкований після fork, уже належить батьківському процесу
+                self.next_id, self.last_id, self.pid = 1, 0, os.getpid()
+            ids = list(range(self.next_id, min(self.last_id, self.next_id + count - 1) + 1))
+            if len(ids) < count:
+                block = self.reserve(max(count - len(ids), self.block_size))
+                ids.extend(block[:count - len(ids)])
+                self.last_id = block[-1]
+            self.next_id = ids[-1] + 1
+            return ids
 
 
 class Notes(Document):
@@ -28,3 +204,79 @@ class Notes(Document):
     tags = ListField(StringField(min_length=1, max_length=15, required=True))
     execution_date = DateField()
     is_done = BooleanField(default=False)
+
+    # Поля, які потрібні для показу нотатки
+    VIEW_FIELDS = ('_id', 'text', 'tags', 'execution_date')
+
+    # Текстовий індекс з префіксом is_done: пошук серед виконаних або невиконаних - один
+    # індексний запит. Без мовних правил: нотатки бувають не англійською
+    # (is_done, tags, _id) - відбір за тегом з порядком за _id без сортування в пам'яті
+    meta = {'indexes': [{'fields': ['is_done', '$text'], 'default_language': 'none'},
+                        ('is_done', 'tags', '_id')]}
+
+    @classmethod
+    def filtered(cls, words=(), tags=(), date_from=None, date_to=None, is_done=False):
+        """Нотатки з усіма words у тексті, усіма tags і датою виконання в межах [date_from, date_to]"""
+        notes = cls.objects(is_done=is_done)
+        if tags:
+            notes = notes.filter(tags__all=list(tags))
+        if date_from is not None:
+            notes = notes.filter(execution_date__gte=date_from)
+        if date_to is not None:
+            notes = notes.filter(execution_date__lte=date_to)
+        phrases = ' '.join(f'"{word}"' for word in (word.replace('"', '') for word in words) if word)
+        return notes.search_text(phrases) if phrases else notes
+
+    @classmethod
+    def find(cls, words, tags=(), is_done=False):
+        """Нотатки, що містять усі words (і всі tags), найрелевантніші першими"""
+        return cls.filtered(words, tags, is_done=is_done).order_by('$text_score')
+
+    @classmethod
+    def update_tags(cls, notes, add=(), remove=()) -> int:
+        """Додає і прибирає теги всіх нотаток notes одним update_many; повертає кількість змінених"""
+        for tag in (*add, *remove):
+            cls.tags.field.validate(tag)
+        update = {}
+        if add:
+            update['add_to_set__tags'] = list(add)
+        if remove:
+            update['pull_all__tags'] = list(remove)
+        return notes.update(full_result=True, **update).modified_count
+
+    @classmethod
+    def tag_counts(cls, is_done=False) -> list:
+        """Теги за алфавітом з кількістю нотаток; групування на сервері, за потреби з диском"""
+        pipeline = [{'$project': {'tags': 1}}, {'$unwind': '$tags'},
+                    {'$group': {'_id': '$tags', 'count': {'$sum': 1}}}, {'$sort': {'_id': 1}}]
+        return list(cls.objects(is_done=is_done).aggregate(pipeline, allowDiskUse=True))
+
+    @classmethod
+    def by_tags(cls, is_done=False):
+        """Пари (тег, нотатка) за тегами; нотатки тегу читаються, лише коли до нього дійшла черга"""
+        # Назви тегів - distinct за індексом (is_done, tags, _id), без підрахунку всіх нотаток
+        for tag in sorted(cls.objects(is_done=is_done).distinct('tags')):
+            notes = cls.objects(is_done=is_done, tags=tag).order_by('_id')
+            for note in raw_view(notes, cls.VIEW_FIELDS):
+                yield tag, note
+
+    @classmethod
+    def insert_notes(cls, notes: list, from_block=False) -> list:
+        """Вставляє нотатки одним insert_many, повертає їхні _id.
+
+        _id резервуються одним запитом рівно на len(notes); з from_block - беруться з блоку
+        NOTE_IDS, що вигідно довгим процесам з частими малими вставками
+        """
+        if not notes:
+            return []
+        ids = NOTE_IDS.take(len(notes)) if from_block else list(NOTE_IDS.reserve(len(notes)))
+        documents = []
+        for note, id_ in zip(notes, ids):
+            note._id = id_
+            note.validate()
+            documents.append(note.to_mongo())
+        cls._get_collection().insert_many(documents)
+        return ids
+
+
+NOTE_IDS = IdBlocks(Notes)
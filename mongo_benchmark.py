@@ -0,0 +1,136 @@
+import datetime
+import itertools
+import random
+import string
+import time
+import timeit
+
+from mongoengine import connect, disconnect, Q
+
+from models.models import Contacts, Notes, NOTE_IDS, raw_view
+from units.adressbook import view_contact
+from units.notebook import view_note
+
+BENCHMARK_HOST = 'mongodb://localhost:27017/assistant_benchmark'
+
+
+def use_benchmark_db(host=BENCHMARK_HOST):
+    """Перемикає моделі на окрему базу, щоб не зачепити дані помічника"""
+    disconnect()
+    connect(host=host)
+
+
+def random_word(rng, low=4, high=10):
+    return ''.join(rng.choices(string.ascii_lowercase, k=rng.randint(low, high)))
+
+
+def generate_contacts(size=1_000_000, chunk_size=10_000, seed=1):
+    """Заповнює колекцію size контактами пакетами через insert_many"""
+    rng = random.Random(seed)
+    Contacts.drop_collection()
+    Contacts.ensure_indexes()
+    collection = Contacts._get_collection()
+    for start in range(0, size, chunk_size):
+        documents = []
+        for index in range(start, min(start + chunk_size, size)):
+            contact = Contacts(name=f'{random_word(rng).title()} {random_word(rng).title()} {index}',
+                               phones=[f'+38050{rng.randrange(10 ** 7):07d}'],
+                               emails=[f'{random_word(rng)}@{random_word(rng, 3, 6)}.com'])
+            contact.clean()
+            documents.append(contact.to_mongo())
+        collection.insert_many(documents, ordered=False)
+
+
+def generate_notes(size=1_000_000, chunk_size=10_000, seed=1, words=5_000, tags=200):
+    """Заповнює колекцію size нотатками з текстом зі словника words слів і тегами з tags"""
+    rng = random.Random(seed)
+    vocabulary = [random_word(rng) for _ in range(words)]
+    tag_names = [random_word(rng, 3, 12).title() for _ in range(tags)]
+    Notes.drop_collection()
+    Notes.ensure_indexes()
+    start_date = datetime.datetime(2022, 1, 1)
+    for start in range(0, size, chunk_size):
+        documents = [{'_id': index + 1,
+                      'text': ' '.join(rng.choices(vocabulary, k=rng.randint(3, 20)))[:255],
+                      'tags': sorted(set(rng.choices(tag_names, k=rng.randint(0, 3)))),
+                      'execution_date': start_date + datetime.timedelta(days=rng.randrange(730)),
+                      'is_done': rng.random() < 0.3}
+                     for index in range(start, min(start + chunk_size, size))]
+        Notes._get_collection().insert_many(documents, ordered=False)
+    # Лічильник SequenceField має продовжувати згенеровані _id
+    Notes._get_db()['mongoengine.counters'].update_one({'_id': 'notes._id'}, {'$set': {'next': size}}, upsert=True)
+
+
+def render_rate(size=100_000, batch_size=None):
+    """Записів за секунду при показі size документів через Document і через raw_view()"""
+    generate_contacts(size)
+    generate_notes(size)
+    paths = {
+        'contacts': (view_contact, Contacts.objects(), Contacts.VIEW_FIELDS),
+        'notes': (view_note, Notes.objects(), Notes.VIEW_FIELDS),
+    }
+    for name, (view, queryset, fields) in paths.items():
+        for title, records in (('Document', queryset.clone()), ('raw', raw_view(queryset.clone(), fields, batch_size))):
+            start = time.perf_counter()
+            count = sum(1 for record in records if view(record))
+            print(f'{name:8} {title:8} {count / (time.perf_counter() - start):10.0f} rows/sec')
+
+
+def insert_rate(size=100_000, chunk_size=1000):
+    """Час вставки size нотаток по одній через SequenceField і пакетами з резервуванням _id"""
+    texts = [f'Benchmark note {index}' for index in range(size)]
+    Notes.drop_collection()
+    start = time.perf_counter()
+    for text in texts:
+        Notes(text=text).save()
+    print(f'save() per note:        {size / (time.perf_counter() - start):10.0f} notes/sec')
+    Notes.drop_collection()
+    start = time.perf_counter()
+    for index in range(0, size, chunk_size):
+        Notes.insert_notes([Notes(text=text) for text in texts[index:index + chunk_size]])
+    print(f'insert_notes() x {chunk_size}: {size / (time.perf_counter() - start):10.0f} notes/sec')
+    single = NOTE_IDS.take()[0]
+    print(f'IDs stay unique and increasing: {Notes.objects.count() == size and single > size}')
+
+
+def find_note_latency(queries=3, repeats=5, seed=1):
+    """Час пошуку нотаток за словами: icontains по кожній нотатці і текстовий індекс"""
+    rng = random.Random(seed)
+    sample = Notes.objects(is_done=False).only('text').limit(100)
+    for text in rng.sample([note.text for note in sample], queries):
+        words = text.split()[:2]
+        scan = Notes.objects(is_done=False, text__icontains=words[0])
+        scan_time = timeit.timeit(lambda: list(raw_view(scan.clone(), Notes.VIEW_FIELDS)), number=repeats) / repeats
+        found = Notes.find(words)
+        index_time = timeit.timeit(lambda: list(raw_view(found.clone(), Notes.VIEW_FIELDS)), number=repeats) / repeats
+        page_time = timeit.timeit(lambda: list(raw_view(found.clone(), Notes.VIEW_FIELDS).limit(3)),
+                                  number=repeats) / repeats
+        print(f'find note {" ".join(words)!r:25} icontains: {scan_time * 1000:9.1f} ms, '
+              f'text index: {index_time * 1000:9.1f} ms, first page: {page_time * 1000:9.1f} ms')
+
+
+def tags_latency(repeats=5):
+    """Час підрахунку тегів і першої сторінки нотаток, згрупованих за тегами"""
+    counts_time = timeit.timeit(Notes.tag_counts, number=repeats) / repeats
+    page_time = timeit.timeit(lambda: list(itertools.islice(Notes.by_tags(), 3)), number=repeats) / repeats
+    print(f'tag counts: {counts_time * 1000:9.1f} ms, first page grouped by tags: {page_time * 1000:9.1f} ms')
+
+
+def search_latency(queries=('olen', 'kra', '0501', 'mail.c', 'zq'), repeats=5):
+    """Час пошуку через icontains (повний прохід) і через індекс search_tokens"""
+    for query in queries:
+        scan = Contacts.objects(Q(name__icontains=query) | Q(phones__icontains=query) | Q(emails__icontains=query))
+        scan_time = timeit.timeit(lambda: list(scan.clone()), number=repeats) / repeats
+        index_time = timeit.timeit(lambda: Contacts.search(query), number=repeats) / repeats
+        print(f'search {query!r:10} icontains: {scan_time * 1000:9.1f} ms, search_tokens: {index_time * 1000:9.1f} ms')
+
+
+if __name__ == '__main__':
+    use_benchmark_db()
+    render_rate()
+    insert_rate()
+    generate_notes()
+    find_note_latency()
+    tags_latency()
+    generate_contacts()
+    search_latency()
@@ -1,7 +1,8 @@
 import datetime
+import itertools
 import re
 
-from mongoengine import NotUniqueError, Q
+from mongoengine import NotUniqueError, ValidationError
 from prompt_toolkit import prompt
 from prompt_toolkit.auto_suggest import AutoSuggestFromHistory
 from prompt_toolkit.completion import NestedCompleter
@@ -9,9 +10,9 @@ from prompt_toolkit.history import FileHistory
 from pymongo.errors import DuplicateKeyError
 
 from units.command_parser import command_parser, RainbowLexer
-from units.paginator import Paginator, hyphenation_string
+from units.paginator import Paginator, field_value, hyphenation_string, show
 
-from models.models import Contacts
+from models.models import Contacts, raw_view, search_tokens
 
 
 class PhoneUserAlreadyExists(Exception):
@@ -53,6 +54,8 @@ class InputError:
             return 'Error! You cannot add an existing email to a user'
         except DateIsNotValid:
             return 'Error! Date is not valid'
+        except ValidationError:
+            return 'Error! The input data is not valid'
         except AttributeError:
             return 'Error! Email is not valid'
         except FindNotFound:
@@ -90,12 +93,19 @@ def is_valid_email(mail_):
     return get_emails
 
 
+def duplicate_field(error: NotUniqueError) -> str:
+    """Поле, унікальний індекс якого порушено ('name', 'phones', 'emails'), з повідомлення сервера"""
+    found = re.search(r'index: (\w+?)_1\b', str(error))
+    return found.group(1) if found else ''
+
+
 def view_contact(contact):
-    name_ = contact.name
-    birthday_ = datetime.date.strftime(contact.birthday, '%d %b %Y') if contact.birthday else ' - '
-    address_ = contact.address
-    phones_ = ', '.join(sorted(contact.phones))
-    emails_ = ', '.join(sorted(contact.emails))
+    name_ = field_value(contact, 'name')
+    birthday_ = field_value(contact, 'birthday')
+    birthday_ = datetime.date.strftime(birthday_, '%d %b %Y') if birthday_ else ' - '
+    address_ = field_value(contact, 'address')
+    phones_ = ', '.join(sorted(field_value(contact, 'phones', [])))
+    emails_ = ', '.join(sorted(field_value(contact, 'emails', [])))
     return f'\033[34mContact\033[0m \033[35m{name_:50}\033[0m \033[34mBirthday:\033[0m {birthday_}\n' + \
         hyphenation_string(f'\033[34mPhones:\033[0m {phones_ if phones_ else " - "}') + '\n' + \
         hyphenation_string(f'\033[34mEmail:\033[0m {emails_ if emails_ else " - "}') + '\n' + \
@@ -115,18 +125,25 @@ def add_contact(*args):
             return f'Contact {add_name} now exist!'
 
     add_phone = phone_normalizer(args[1])
+    if add_phone is None:
+        raise ValueError
 
-    find_phone = Contacts.objects(phones=add_phone)
-    contact = Contacts.objects(name=add_name).first()
-    if find_phone:
+    # modify() не перевіряє документ, тому обмеження полів перевіряються до запиту
+    Contacts(name=add_name, phones=[add_phone]).validate()
+    # Один запит: upsert контакту, унікальність телефону забезпечує індекс
+    for attempt in range(2):
+        try:
+            old_contact = Contacts.objects(name=add_name).only('phones').modify(
+                upsert=True, new=False, add_to_set__phones=add_phone,
+                add_to_set__search_tokens=search_tokens(add_name, add_phone), set_on_insert__birthday_key=0)
+            break
+        except NotUniqueError as error:
+            field = duplicate_field(error)
+            # Збіг імені: паралельний upsert щойно вставив контакт, повтор стане оновленням
+            if field != 'name' or attempt:
+                return f'Contact {add_name} now exist!' if field == 'name' else f'Phone {add_phone} now exist'
+    if old_contact is not None and add_phone in old_contact.phones:
         return f'Phone {add_phone} now exist'
-    if contact:
-        contact.phones.append(add_phone)
-        contact.save()
-    else:
-        new_contact = Contacts(name=add_name)
-        new_contact.phones = [add_phone]
-        new_contact.save()
     return f'Add contact {add_name} with phone number {add_phone}'
 
 
@@ -142,19 +159,18 @@ def change_contact(*args):
     if new_phone is None:
         return 'Error! New phone number is incorrect!'
 
-    contact = Contacts.objects(Q(name=name_) & Q(phones=old_phone)).first()
-    if not contact:
-        return f'Contact {name_} with {old_phone} not exist!'
-
-    find_phone = Contacts.objects(phones=new_phone)
-    if find_phone:
+    # $nor: новий номер, який уже є в цього ж контакту, не повинен з'явитися двічі
+    contacts = Contacts.objects(__raw__={'name': name_, 'phones': old_phone, '$nor': [{'phones': new_phone}]})
+    try:
+        changed = contacts.update_one(set__phones__S=new_phone,
+                                      add_to_set__search_tokens=search_tokens(new_phone))
+    except NotUniqueError:
         return f'Phone {new_phone} now exist'
-
-    phones = contact.phones
-    phones.remove(old_phone)
-    phones.append(new_phone)
-    contact.phones = phones
-    contact.save()
+    if not changed:
+        # Другий запит лише для повідомлення про помилку
+        if Contacts.objects(name=name_, phones=new_phone):
+            return f'Phone {new_phone} now exist'
+        return f'Contact {name_} with {old_phone} not exist!'
     return f'Change to contact {name_} phone number from {old_phone} to {new_phone}'
 
 
@@ -174,27 +190,16 @@ def del_phone(*args):
     if phone_ is None:
         return 'Error! Phone number is incorrect!'
 
-    contact = Contacts.objects(Q(name=name_) & Q(phones=phone_)).first()
-    if contact:
-        phones = contact.phones
-        phones.remove(phone_)
-        contact.phones = phones
-        contact.save()
+    # Токени видаленого номера лишаються: це лише зайві кандидати для пошуку
+    if Contacts.objects(name=name_, phones=phone_).update_one(pull__phones=phone_):
         return f'Delete phone {phone_} from contact {name_}'
     else:
         return f'Contact {name_} with {phone_} not exist!'
 
 
 def show_all(*args):
-    contacts = Contacts.objects().order_by('name')
-    result = 'List of all users:\n'
-    print_list = Paginator(contacts).get_view(func=view_contact)
-    for item in print_list:
-        if item is None:
-            return 'No contacts found'
-        else:
-            result += f'{item}'
-    return result
+    contacts = raw_view(Contacts.objects().order_by('name'), Contacts.VIEW_FIELDS)
+    return Paginator(contacts, view_contact, 'List of all users:\n', 'No contacts found', key='name')
 
 
 @InputError
@@ -230,15 +235,9 @@ def days_to_user_birthday(*args):
 @InputError
 def show_birthday(*args):
     days = int(args[0])
-    contacts = Contacts.objects(birthday__ne=None)
-    result = 'List of all users:\n'
-    print_list = Paginator([c for c in contacts if c.days_to_birthday() <= days]).get_view(func=view_contact)
-    for item in print_list:
-        if item is None:
-            return 'No contacts found'
-        else:
-            result += f'{item}'
-    return result
+    contacts = itertools.chain.from_iterable(raw_view(queryset, Contacts.VIEW_FIELDS)
+                                             for queryset in Contacts.birthdays_within(days))
+    return Paginator(contacts, view_contact, 'List of all users:\n', 'No contacts found')
 
 
 def goodbye(*args):
@@ -247,18 +246,16 @@ def goodbye(*args):
 
 @InputError
 def search(*args):
-    if len(args) == 1:
+    # Друге слово - лише номер сторінки: пошук за кількома словами не підтримується
+    if len(args) == 1 or len(args) == 2 and args[1].isdigit() and int(args[1]) > 0:
         substr = args[0]
-        contacts = Contacts.objects(Q(name__icontains=substr) | Q(phones__icontains=substr) | Q(emails__icontains=substr))
-
-        result = f'List of users with \'{substr.lower()}\' in data:\n'
-        print_list = Paginator(contacts).get_view(func=view_contact)
-        for item in print_list:
-            if item is None:
-                return f'Users with \'{substr.lower()}\' in data not found'
-            else:
-                result += f'{item}'
-        return result
+        page = int(args[1]) if len(args) == 2 else 1
+        contacts, has_next = Contacts.search(substr, page)
+        more = f'next: search {substr} {page + 1}' if has_next else 'last'
+
+        return Paginator(contacts, view_contact,
+                         f'List of users with \'{substr.lower()}\' in data (page {page}, {more}):\n',
+                         f'Users with \'{substr.lower()}\' in data not found')
     else:
         raise FindNotFound
 
@@ -277,18 +274,24 @@ def del_user(*args):
 
 @InputError
 def add_email(*args):
-    name_, emails_ = args[0], is_valid_email(' '.join(args[1:]))
-    contact = Contacts.objects(name=name_).first()
-    if not contact:
-        return f'Contact {name_} not exist!'
-
-    result_emails = []
-    for email_ in emails_:
-        find_email = Contacts.objects(emails=email_)
-        if not find_email:
-            result_emails.append(email_)
-            contact.emails.append(email_)
-            contact.save()
+    name_, emails_ = args[0], list(dict.fromkeys(is_valid_email(' '.join(args[1:]))))
+    contact = Contacts.objects(name=name_).only('emails')
+    try:
+        old_contact = contact.modify(new=False, add_to_set__emails=emails_,
+                                     add_to_set__search_tokens=search_tokens(*emails_))
+        if old_contact is None:
+            return f'Contact {name_} not exist!'
+        result_emails = [email_ for email_ in emails_ if email_ not in old_contact.emails]
+    except NotUniqueError:
+        # Якийсь email уже належить іншому контакту - додаємо решту по одному
+        result_emails = []
+        for email_ in emails_:
+            try:
+                if contact.filter(emails__ne=email_).update_one(add_to_set__emails=email_,
+                                                               add_to_set__search_tokens=search_tokens(email_)):
+                    result_emails.append(email_)
+            except NotUniqueError:
+                pass
     if result_emails:
         return f'Email(s) {", ".join(result_emails)} add to contact {name_}'
     else:
@@ -301,12 +304,7 @@ def del_email(*args):
     if email_ is None:
         return 'Error! Email is incorrect!'
 
-    contact = Contacts.objects(Q(name=name_) & Q(emails=email_)).first()
-    if contact:
-        emails = contact.emails
-        emails.remove(email_)
-        contact.emails = emails
-        contact.save()
+    if Contacts.objects(name=name_, emails=email_).update_one(pull__emails=email_):
         return f'Delete email {email_} from contact {name_}'
     else:
         return f'Contact {name_} with {email_} not exist!'
@@ -338,7 +336,7 @@ def help_me(*args):
     address <name> <address> - add/modify the contact's address;
     show <name> - show the contact's data;
     show all - show data of all contacts;
-    find or search <sub> - show data of all contacts with sub in name, phones or emails;
+    find or search <sub> [<page>] - show data of contacts with sub in name, phones or emails, best matches first;
     days to birthday <name> - show how many days to the contact's birthday;
     show birthday days <N> - show the contact's birthday in the next N days;
     good bye or close or exit or . - exit the program"""
@@ -352,6 +350,8 @@ COMMANDS_A = {salute: ['hello'], add_contact: ['add '], change_contact: ['change
 
 
 def start_ab():
+    Contacts.migrate_birthday_keys()
+    Contacts.migrate_search_tokens()
     print('\n\033[033mWelcome to the address book!\033[0m')
     print(f"\033[032mType command or '?' for help \033[0m\n")
     while True:
@@ -365,7 +365,7 @@ def start_ab():
                               lexer=RainbowLexer()
                               )
         command, data = command_parser(user_command, COMMANDS_A)
-        print(command(*data), '\n')
+        show(command(*data))
         if command is goodbye:
             break
 
@@ -9,9 +9,9 @@ from prompt_toolkit.completion import NestedCompleter
 from prompt_toolkit.history import FileHistory
 
 from units.command_parser import RainbowLexer
-from units.paginator import Paginator, hyphenation_string
+from units.paginator import Paginator, field_value, hyphenation_string, show
 
-from models.models import Notes, ValidationError, InvalidQueryError
+from models.models import Notes, ValidationError, InvalidQueryError, raw_view
 
 
 class DateIsNotValid(Exception):
@@ -41,24 +41,50 @@ class InputError:
             return 'Error! Note not exist!'
 
 def view_note(note):
-    id_ = note._id
-    text_ = note.text
-    date_ = datetime.date.strftime(note.execution_date, '%d %b %Y') if note.execution_date else '     -    '
-    tags = [tag for tag in note.tags]
+    id_ = field_value(note, '_id')
+    text_ = field_value(note, 'text')
+    date_ = field_value(note, 'execution_date')
+    date_ = datetime.date.strftime(date_, '%d %b %Y') if date_ else '     -    '
+    tags = sorted(field_value(note, 'tags', []))
     return f"\033[34mID:\033[0m {id_:^10} {' ' * 47} \033[34mDate:\033[0m {date_}\n" \
            f"\033[34mTags:\033[0m {', '.join(tags)}\n" \
            f"{hyphenation_string(text_)}"
 
 
+def parse_tags(text) -> list:
+    return list(dict.fromkeys(re.sub(r'[;,.!?]', ' ', text).title().split()))
+
+
+def parse_date(text) -> datetime.date:
+    try:
+        return datetime.datetime.strptime(text, '%Y-%m-%d').date()
+    except ValueError:
+        try:
+            return datetime.datetime.strptime(text, '%d.%m.%Y').date()
+        except ValueError:
+            raise DateIsNotValid
+
+
 @InputError
 def add_note(*args):
     """Додає нотатку"""
     note_text = ' '.join(args)
+    # Одна нотатка отримує наступний _id лічильника: блок NOTE_IDS лишив би пропуск у номерах
     note = Notes(text=note_text)
     note.save()
     return f'Note ID:{note._id} added'
 
 
+@InputError
+def add_notes(*args):
+    """Додає кілька нотаток, розділених ';', одним запитом"""
+    texts = [text.strip() for text in ' '.join(args).split(';') if text.strip()]
+    ids = Notes.insert_notes([Notes(text=text) for text in texts])
+    if not ids:
+        return 'No notes added'
+    return f'Notes ID:{", ".join(map(str, ids))} added'
+
+
 @InputError
 def change_note(*args):
     id_note, new_text = int(args[0]), ' '.join(args[1:])
@@ -88,14 +114,7 @@ def del_note(*args):
 @InputError
 def add_date(*args):
     """Додає дату нотатки"""
-    id_note, exec_date_str = int(args[0]), args[1]
-    try:
-        exec_date = datetime.datetime.strptime(exec_date_str, '%Y-%m-%d').date()
-    except ValueError:
-        try:
-            exec_date = datetime.datetime.strptime(exec_date_str, '%d.%m.%Y').date()
-        except ValueError:
-            raise DateIsNotValid
+    id_note, exec_date = int(args[0]), parse_date(args[1])
     note = Notes.objects(_id=id_note)
     if note:
         note.update(execution_date=exec_date)
@@ -107,24 +126,63 @@ def add_date(*args):
 @InputError
 def add_tag(*args):
     id_note = int(args[0])
-    note_tags = re.sub(r'[;,.!?]', ' ', ' '.join(args[1:])).title().split()
-    note_tags = list(set(note_tags))
-    note = Notes.objects(_id=id_note)
-    if not note:
+    note_tags = parse_tags(' '.join(args[1:]))
+    for tag in note_tags:
+        Notes.tags.field.validate(tag)
+    # Один запит: $addToSet повертає нотатку до зміни, з неї видно, які теги нові
+    old_note = Notes.objects(_id=id_note).only('tags').modify(new=False, add_to_set__tags=note_tags)
+    if old_note is None:
         return f'Note ID:{id_note} not exist!'
 
-    old_note = note[0].tags
-    # Додавання тегів, яких ще немає
-    result_tag = [tag for tag in note_tags if not tag in old_note]
-    note_tags.extend(old_note)
-    note_tags = sorted(list(set(note_tags)))
-    note.update(tags=note_tags)
+    result_tag = [tag for tag in note_tags if tag not in old_note.tags]
     if result_tag:
         return f'Tags {", ".join(sorted(result_tag))} added to note ID:{id_note}'
     else:
         return f'No tags added to note ID:{id_note}'
 
 
+def bulk_tags(args, add):
+    """Теги і фільтр нотаток з аргументів: text=<слово>, from=<дата>, to=<дата>, tag=<тег>, --done.
+
+    Без фільтра зміна всіх нотаток потребує явного --all
+    """
+    tags, words, filters = [], [], {'tags': [], 'is_done': '--done' in args}
+    for arg in args:
+        name, _, value = arg.partition('=')
+        if arg in ('--done', '--all'):
+            continue
+        if not value:
+            tags.extend(parse_tags(arg))
+        elif name == 'text':
+            words.append(value)
+        elif name == 'tag':
+            filters['tags'].append(value.title())
+        elif name in ('from', 'to'):
+            filters[f'date_{name}'] = parse_date(value)
+        else:
+            raise ValueError
+    if not tags:
+        raise IndexError
+    # Одне слово, набране замість фільтра, не повинно змінити весь нотатник
+    if not (words or filters['tags'] or 'date_from' in filters or 'date_to' in filters or '--all' in args):
+        return 'Error! Give a filter (text=, from=, to=, tag=) or --all to change every note'
+    notes = Notes.filtered(words, **filters)
+    modified = Notes.update_tags(notes, add=tags) if add else Notes.update_tags(notes, remove=tags)
+    return f'Tags {", ".join(tags)} {"added to" if add else "removed from"} {modified} note(s)'
+
+
+@InputError
+def tag_notes(*args):
+    """Додає теги всім нотаткам, що відповідають фільтру"""
+    return bulk_tags(args, add=True)
+
+
+@InputError
+def untag_notes(*args):
+    """Прибирає теги з усіх нотаток, що відповідають фільтру"""
+    return bulk_tags(args, add=False)
+
+
 @InputError
 def done_note(*args):
     """Помічає нотатку як виконану"""
@@ -152,55 +210,34 @@ def return_note(*args):
 def show_all(*args):
     """Повертає всі нотатки"""
     notes = Notes.objects(is_done=False)
-    result = 'List of all notes:\n'
-    print_list = Paginator(notes).get_view(func=view_note)
-    for item in print_list:
-        if item is None:
-            return 'No notes found'
-        else:
-            result += f'{item}'
-    return result
+    return Paginator(raw_view(notes.order_by('_id'), Notes.VIEW_FIELDS), view_note,
+                     'List of all notes:\n', 'No notes found', key='_id')
 
 
 def show_archiv(*args):
     """Повертає нотатки з архіву"""
     notes = Notes.objects(is_done=True)
-    result = 'List of all archived notes:\n'
-    print_list = Paginator(notes).get_view(func=view_note)
-    for item in print_list:
-        if item is None:
-            return 'No notes found'
-        else:
-            result += f'{item}'
-    return result
+    return Paginator(raw_view(notes.order_by('_id'), Notes.VIEW_FIELDS), view_note,
+                     'List of all archived notes:\n', 'No notes found', key='_id')
 
 
+@InputError
 def find_note(*args):
-    """Повертає нотатки за входженням в текст"""
-    subtext = args[0]
-    notes = Notes.objects(Q(is_done=False) & Q(text__icontains=subtext))
-    result = f'List of notes with text "{subtext}":\n'
-    print_list = Paginator(notes).get_view(func=view_note)
-    for item in print_list:
-        if item is None:
-            return 'No notes found'
-        else:
-            result += f'{item}'
-    return result
+    """Повертає нотатки з усіма словами тексту: #тег - лише з тегом, --done - серед виконаних"""
+    tags = [arg[1:].title() for arg in args if arg.startswith('#') and len(arg) > 1]
+    words = [arg for arg in args if not arg.startswith('#') and arg != '--done']
+    if not words:
+        raise IndexError
+    notes = Notes.find(words, tags, is_done='--done' in args)
+    return Paginator(raw_view(notes, Notes.VIEW_FIELDS), view_note,
+                     f'List of notes with text "{" ".join(words)}":\n', 'No notes found')
 
 
 @InputError
 def show_date(*args):
     """Повертає нотатки з вказаною датою виконання"""
 
-    exec_date_str = args[0]
-    try:
-        exec_date = datetime.datetime.strptime(exec_date_str, '%Y-%m-%d').date()
-    except ValueError:
-        try:
-            exec_date = datetime.datetime.strptime(exec_date_str, '%d.%m.%Y').date()
-        except ValueError:
-            raise DateIsNotValid
+    exec_date = parse_date(args[0])
 
     if len(args) > 1:
         days = int(args[1])
@@ -213,14 +250,8 @@ def show_date(*args):
     # notes = session.query(Note).filter(and_(not_(Note.is_done), Note.execution_date >= date1,
     #                                         Note.execution_date <= date2)).order_by(Note.id).all()
 
-    result = 'List of notes with date:\n'
-    print_list = Paginator(notes).get_view(func=view_note)
-    for item in print_list:
-        if item is None:
-            return 'No notes found'
-        else:
-            result += f'{item}'
-    return result
+    return Paginator(raw_view(notes.order_by('_id'), Notes.VIEW_FIELDS), view_note,
+                     'List of notes with date:\n', 'No notes found', key='_id')
 
 
 @InputError
@@ -230,27 +261,27 @@ def find_tag(*args):
     tag_find = args[0].title()
     notes = Notes.objects(Q(is_done=False) & Q(tags=tag_find))
 
-    result = f'List of notes with tag "{tag_find}":\n'
-    print_list = Paginator(notes).get_view(func=view_note)
-    for item in print_list:
-        if item is None:
-            return 'No notes found'
-        else:
-            result += f'{item}'
-    return result
+    return Paginator(raw_view(notes.order_by('_id'), Notes.VIEW_FIELDS), view_note,
+                     f'List of notes with tag "{tag_find}":\n', 'No notes found', key='_id')
+
+
+def view_tag_note(tag_note):
+    tag, note = tag_note
+    return f'\033[34mTag group:\033[0m \033[35m{tag}\033[0m\n{view_note(note)}'
+
+
+def view_tag_count(group):
+    return f'\033[35m{group["_id"]:15}\033[0m {group["count"]} note(s)'
 
 
 def sort_by_tags(*args):
-    notes = Notes.objects(Q(is_done=False) & Q(tags__ne=[])).order_by('tags')
-    # notes = session.query(Note).join(Note.tags).filter(not_(Note.is_done)).order_by(Tag.tag).all()
-    result = f'List of tag-sorted notes":\n'
-    print_list = Paginator(notes).get_view(func=view_note)
-    for item in print_list:
-        if item is None:
-            return 'No notes found'
-        else:
-            result += f'{item}'
-    return result
+    """Повертає невиконані нотатки, згруповані за тегами"""
+    return Paginator(Notes.by_tags(), view_tag_note, 'List of tag-sorted notes:\n', 'No notes found')
+
+
+def show_tags(*args):
+    """Повертає теги невиконаних нотаток з кількістю нотаток"""
+    return Paginator(Notes.tag_counts(), view_tag_count, 'List of tags:\n', 'No tags found', page_size=20)
 
 
 def goodbye(*args):
@@ -266,6 +297,7 @@ def help_me(*args):
     return """\nCommand format:
     help or ? - this help;
     add note <text> - add note;
+    add notes <text>; <text>; ... - add several notes at once;
     change note <id> <text> - change note;
     delete note <id> - delete note;
     add date <id> <date> - add/change date;
@@ -275,17 +307,22 @@ def help_me(*args):
     show all - show all notes;
     show archived - show archived notes;
     show date <date> [<days>] - show notes by date +- days;
-    find note <text> - find note by text;
+    find note <words> [#<tag> ...] [--done] - find notes with all words, best matches first;
     find tag <text> - find note by tag;
-    sort by tags - show all notes sorted by tags;
+    tag notes <tag> [...] [text=<word>] [from=<date>] [to=<date>] [tag=<tag>] [--done] [--all] - add tags to matching notes (--all if no filter);
+    untag notes <tag> [...] [text=<word>] [from=<date>] [to=<date>] [tag=<tag>] [--done] [--all] - remove tags (--all if no filter);
+    sort by tags - show all notes grouped by tags;
+    show tags - show tags with the number of notes;
     good bye or close or exit or . - exit the program"""
 
 
 COMMANDS = {help_me: ['?', 'help'], goodbye: ['good bye', 'close', 'exit', '.'], add_note: ['add note '],
+            add_notes: ['add notes '],
             add_date: ['add date '], show_all: ['show all'], show_archiv: ['show archived'],
             change_note: ['change note '], del_note: ['delete note '], find_note: ['find note '],
             show_date: ['show date '], done_note: ['done '], return_note: ['return '], add_tag: ["add tag"],
-            find_tag: ["find tag"], sort_by_tags: ['sort by tags']}
+            find_tag: ["find tag"], sort_by_tags: ['sort by tags'], show_tags: ['show tags'],
+            tag_notes: ['tag notes '], untag_notes: ['untag notes ']}
 
 
 def command_parser(user_command: str) -> (str, list):
@@ -311,18 +348,19 @@ def start_nb():
                               lexer=RainbowLexer()
                               )
         command, data = command_parser(user_command)
-        print(command(*data), '\n')
+        show(command(*data))
         if command is goodbye:
             break
 
 
 Completer = NestedCompleter.from_nested_dict({'help': None, 'good bye': None, 'exit': None,
                                               'close': None, '?': None, '.': None,
-                                              'add': {'note': None, 'date': None, 'tag': None},
-                                              'show': {'all': None, 'archived': None, 'date': None},
+                                              'add': {'note': None, 'notes': None, 'date': None, 'tag': None},
+                                              'show': {'all': None, 'archived': None, 'date': None, 'tags': None},
                                               'change note': None, 'delete note': None,
                                               'find': {'note': None, 'tag': None}, 'done': None,
-                                              'return': None, 'sort by tags': None})
+                                              'return': None, 'sort by tags': None,
+                                              'tag notes': None, 'untag notes': None})
 
 if __name__ == '__main__':
     start_nb()
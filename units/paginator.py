@@ -1,5 +1,5 @@
-import re
 from abc import ABC, abstractmethod
+from itertools import islice
 
 PAGINATOR_NUMBER = 3  # кількість записів для представлення
 STRING_WIDTH = 80
@@ -7,31 +7,147 @@ STRING_WIDTH = 80
 
 class AbstractPaginator(ABC):
 
+    @abstractmethod
+    def page(self, number):
+        pass
+
     @abstractmethod
     def get_view(self):
         pass
 
 
 class Paginator(AbstractPaginator):
-    def __init__(self, data):
+    """Сторінки записів, що читаються з бази по одній.
+
+    data - QuerySet (або інший об'єкт з skip/limit/count), список чи будь-який ітератор.
+    Для QuerySet кожна сторінка - окремий запит з limit. Якщо задано key - унікальне поле,
+    за яким data відсортовано за зростанням, - сусідні сторінки читаються за ключем
+    (key > останнього на сторінці) без skip. Ітератор читається лише до потрібної сторінки.
+    """
+
+    def __init__(self, data, func=None, title='', empty='No records found', key=None, page_size=PAGINATOR_NUMBER):
         self.data = data
+        self.func = func
+        self.title = title
+        self.empty = empty
+        self.key = key
+        self.page_size = page_size
+        self.is_queryset = all(hasattr(data, name) for name in ('skip', 'limit', 'count', 'clone'))
+        # Уже прочитані з ітератора записи; для QuerySet і списку не потрібні
+        self.buffer = data if isinstance(data, list) else []
+        self.iterator = None if self.is_queryset or isinstance(data, list) else iter(data)
+        self.number, self.records, self.has_next = 0, [], False
 
-    def get_view(self, func):
-        index, print_block = 1, '=' * STRING_WIDTH + '\n'
-        is_empty = True
-        data_values = self.data
-        for record in data_values:
-            is_empty = False
-            print_block += func(record) + '\n' + '-' * STRING_WIDTH + '\n'
-            if index < PAGINATOR_NUMBER:
-                index += 1
-            else:
-                yield print_block
-                index, print_block = 1, '=' * STRING_WIDTH + '\n'
-        if is_empty:
+    def count(self) -> int:
+        if self.is_queryset:
+            return self.data.count(with_limit_and_skip=True)
+        self._read(None)
+        return len(self.buffer)
+
+    def _read(self, stop):
+        if self.iterator is not None and (stop is None or len(self.buffer) < stop):
+            self.buffer.extend(islice(self.iterator, None if stop is None else stop - len(self.buffer)))
+
+    def _slice(self, start, stop) -> list:
+        if self.is_queryset:
+            return list(self.data.clone().skip(start).limit(stop - start))
+        self._read(stop)
+        return self.buffer[start:stop]
+
+    def _set_page(self, number, records, has_next=None):
+        # Порожня сторінка за межами даних не змінює поточну
+        if records or number == 1:
+            self.number = number
+            self.has_next = len(records) > self.page_size if has_next is None else has_next
+            self.records = records[:self.page_size]
+            return self.records
+        return []
+
+    def page(self, number) -> list:
+        """Записи сторінки number (з 1); порожній список, якщо такої сторінки немає"""
+        if number < 1:
+            return []
+        start = (number - 1) * self.page_size
+        # Зайвий запис показує, чи є наступна сторінка, без окремого count()
+        return self._set_page(number, self._slice(start, start + self.page_size + 1))
+
+    def value(self, record):
+        return field_value(record, self.key)
+
+    def next_page(self) -> list:
+        if not self.has_next:
+            return []
+        if self.key is None or not self.is_queryset:
+            return self.page(self.number + 1)
+        after = self.data.clone().filter(**{f'{self.key}__gt': self.value(self.records[-1])})
+        return self._set_page(self.number + 1, list(after.limit(self.page_size + 1)))
+
+    def previous_page(self) -> list:
+        if self.number <= 1:
+            return []
+        if self.key is None or not self.is_queryset:
+            return self.page(self.number - 1)
+        before = self.data.clone().filter(**{f'{self.key}__lt': self.value(self.records[0])})
+        records = list(before.order_by(f'-{self.key}').limit(self.page_size))
+        return self._set_page(self.number - 1, records[::-1], has_next=True)
+
+    def render(self, records=None, func=None) -> str:
+        func = func or self.func
+        separator = '-' * STRING_WIDTH
+        return '\n'.join(['=' * STRING_WIDTH, *(f'{func(record)}\n{separator}' for record in
+                                                (self.records if records is None else records))]) + '\n'
+
+    def get_view(self, func=None):
+        """Відрендерені сторінки по черзі; одна None, якщо записів немає"""
+        records = self.page(1)
+        if not records:
             yield None
-        else:
-            yield print_block
+            return
+        while records:
+            yield self.render(records, func)
+            records = self.next_page()
+
+    def browse(self):
+        """Показує сторінки в терміналі, наступна читається лише на запит користувача"""
+        records = self.page(1)
+        if not records:
+            print(self.empty, '\n')
+            return
+        print(self.title, end='')
+        while True:
+            print(self.render(records), end='')
+            if self.number == 1 and not self.has_next:
+                break
+            answer = input(f'Page {self.number}{"" if self.has_next else " (last)"}. '
+                           f'Enter - next, p - previous, <number> - go to page, q - quit: ').strip().lower()
+            if answer == 'q' or (answer == '' and not self.has_next):
+                break
+            if answer == 'p':
+                records = self.previous_page() or self.records
+            elif answer.isdigit():
+                records = self.page(int(answer))
+                if not records:
+                    print(f'Page {answer} not exist!')
+                    records = self.records
+            else:
+                records = self.next_page() or self.records
+        print()
+
+
+def show(result):
+    """Виводить результат команди: сторінки Paginator - по одній на запит, решту - одразу"""
+    if isinstance(result, AbstractPaginator):
+        result.browse()
+    else:
+        print(result, '\n')
+
+
+def field_value(record, name, default=None):
+    """Значення поля запису: Document або словника з as_pymongo(), де порожніх полів немає"""
+    if isinstance(record, dict):
+        return record.get(name, default)
+    value = getattr(record, name)
+    return default if value is None else value
 
 
 def hyphenation_string(text) -> str:
@@ -48,4 +164,3 @@ def hyphenation_string(text) -> str:
     if line:
         result += line
     return result
-
@@ -1,65 +1,1458 @@
 import redis
+import redis.asyncio
+from collections import Counter, OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from decimal import Decimal
 from functools import wraps
+import bisect
+import datetime
+import enum
+import hashlib
+import importlib
+import asyncio
+import inspect
+import itertools
+import json
+import lzma
+import os
+import threading
+import time
 import types
 import pickle
+import re
+import struct
+import uuid
+import weakref
+import zlib
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
 
 
 class ArgsUnhashable(Exception):
     pass
 
 
-class MyLRU:
-    def __init__(self, client: redis.Redis,
+# Ключ запису містить токен версії "<епоха>.<версія функції>". Епоха змінюється при clear(),
+# версія - при invalidate() функції, тож записи старих версій стають недосяжними за O(1).
+# Скрипти читання перевіряють токен і при розбіжності повертають актуальний
+VERSION_LUA = """
+local function current_version(epoch_key, version_key)
+    return (redis.call('GET', epoch_key) or '0') .. '.' .. (redis.call('GET', version_key) or '0')
+end
+"""
+
+# KEYS: ключ запису, sorted set LRU, лічильник звернень, hash розмірів, сумарний розмір,
+#       епоха кешу, версія функції
+# ARGV: очікуваний токен версії. При розбіжності повертає {актуальний токен}
+GET_SCRIPT = VERSION_LUA + """
+local version = current_version(KEYS[6], KEYS[7])
+if version ~= ARGV[1] then
+    return {version}
+end
+local value = redis.call('GET', KEYS[1])
+if value then
+    redis.call('ZADD', KEYS[2], redis.call('INCR', KEYS[3]), KEYS[1])
+elseif redis.call('ZREM', KEYS[2], KEYS[1]) == 1 then
+    -- Запис зник після закінчення TTL, прибираємо його розмір з бюджету
+    local size = redis.call('HGET', KEYS[4], KEYS[1])
+    if size then
+        redis.call('HDEL', KEYS[4], KEYS[1])
+        redis.call('DECRBY', KEYS[5], size)
+    end
+end
+return value
+"""
+
+# Витіснення найдавніших записів понад max_size і понад бюджет max_bytes (0 - без обмеження).
+# KEYS[2]: sorted set LRU, KEYS[4]: hash розмірів записів, KEYS[5]: сумарний розмір
+# ARGV[2]: max_size, ARGV[3]: канал інвалідації, ARGV[5]: max_bytes
+EVICT_LUA = """
+local evicted = {}
+local function evict(key)
+    redis.call('UNLINK', key)
+    local size = redis.call('HGET', KEYS[4], key)
+    if size then
+        redis.call('HDEL', KEYS[4], key)
+        redis.call('DECRBY', KEYS[5], size)
+    end
+    table.insert(evicted, key)
+end
+local excess = redis.call('ZCARD', KEYS[2]) - tonumber(ARGV[2])
+if excess > 0 then
+    local popped = redis.call('ZPOPMIN', KEYS[2], excess)
+    for i = 1, #popped, 2 do
+        evict(popped[i])
+    end
+end
+local max_bytes = tonumber(ARGV[5])
+if max_bytes > 0 then
+    while tonumber(redis.call('GET', KEYS[5]) or '0') > max_bytes do
+        local popped = redis.call('ZPOPMIN', KEYS[2])
+        if #popped == 0 then
+            break
+        end
+        evict(popped[1])
+    end
+end
+if #evicted > 0 then
+    redis.call('PUBLISH', ARGV[3], '\\n' .. table.concat(evicted, '\\n'))
+end
+return #evicted
+"""
+
+# KEYS: ключ запису, sorted set LRU, лічильник звернень, hash розмірів, сумарний розмір
+# ARGV: значення, max_size, канал інвалідації, ідентифікатор процесу, max_bytes,
+#       час життя ключа в мілісекундах (0 - без обмеження), '1' - перевірка допуску
+# Повідомлення в каналі: перший рядок - автор запису, далі ключі для видалення з L1
+# Повертає кількість витіснених записів. При перевірці допуску в повний кеш нічого не
+# записує і повертає {кандидат на витіснення} - рішення приймає клієнт
+SET_SCRIPT = """
+if ARGV[7] == '1' and redis.call('ZCARD', KEYS[2]) >= tonumber(ARGV[2])
+        and not redis.call('ZSCORE', KEYS[2], KEYS[1]) then
+    local victim = redis.call('ZRANGE', KEYS[2], 0, 0)
+    if #victim > 0 then
+        return victim
+    end
+end
+if tonumber(ARGV[6]) > 0 then
+    redis.call('SET', KEYS[1], ARGV[1], 'PX', ARGV[6])
+else
+    redis.call('SET', KEYS[1], ARGV[1])
+end
+local old_size = redis.call('HGET', KEYS[4], KEYS[1])
+if old_size then
+    redis.call('DECRBY', KEYS[5], old_size)
+end
+redis.call('HSET', KEYS[4], KEYS[1], #ARGV[1])
+redis.call('INCRBY', KEYS[5], #ARGV[1])
+redis.call('ZADD', KEYS[2], redis.call('INCR', KEYS[3]), KEYS[1])
+redis.call('PUBLISH', ARGV[3], ARGV[4] .. '\\n' .. KEYS[1])
+""" + EVICT_LUA
+
+# Ті самі KEYS і ARGV, що й у SET_SCRIPT; ключ запису і значення не використовуються
+TRIM_SCRIPT = EVICT_LUA
+
+# KEYS: sorted set LRU, лічильник звернень, епоха кешу, версія функції, далі ключі записів
+# ARGV: очікуваний токен версії
+# Повертає значення в тому ж порядку (nil для відсутніх) і оновлює позиції знайдених у LRU.
+# При розбіжності версії повертає актуальний токен рядком замість списку
+GET_MANY_SCRIPT = VERSION_LUA + """
+local version = current_version(KEYS[3], KEYS[4])
+if version ~= ARGV[1] then
+    return version
+end
+local values = {}
+local clock = redis.call('INCRBY', KEYS[2], #KEYS - 4)
+for i = 5, #KEYS do
+    local value = redis.call('GET', KEYS[i])
+    if value then
+        redis.call('ZADD', KEYS[1], clock - #KEYS + i, KEYS[i])
+    end
+    values[i - 4] = value
+end
+return values
+"""
+
+# KEYS: sorted set LRU, hash розмірів, сумарний розмір, далі ключі записів застарілих версій
+DROP_SCRIPT = """
+for i = 4, #KEYS do
+    redis.call('ZREM', KEYS[1], KEYS[i])
+    local size = redis.call('HGET', KEYS[2], KEYS[i])
+    if size then
+        redis.call('HDEL', KEYS[2], KEYS[i])
+        redis.call('DECRBY', KEYS[3], size)
+    end
+    redis.call('UNLINK', KEYS[i])
+end
+return #KEYS - 3
+"""
+
+# <простір імен функції>:v<епоха>.<версія>:<суфікс>
+VERSIONED_KEY = re.compile(r'^(.+?):v(\d+\.\d+):')
+
+# KEYS: блокування; ARGV: токен власника. Знімає блокування, лише якщо воно ще наше
+RELEASE_SCRIPT = """
+if redis.call('GET', KEYS[1]) == ARGV[1] then
+    return redis.call('DEL', KEYS[1])
+end
+return 0
+"""
+
+
+_MISSING = object()
+
+_pools = {}
+_pools_lock = threading.Lock()
+
+
+def connection_pool(url='redis://localhost:6379/0', **kwargs) -> redis.ConnectionPool:
+    """Спільний для всіх кешів процесу пул з'єднань до url.
+
+    Після fork redis-py сам відкидає успадковані з'єднання пулу, тож дочірній процес
+    відкриває власні, не торкаючись сокетів батьківського.
+    """
+    key = (url, tuple(sorted(kwargs.items())))
+    with _pools_lock:
+        if key not in _pools:
+            _pools[key] = redis.ConnectionPool.from_url(url, **kwargs)
+        return _pools[key]
+
+
+def _canonical(value, out: bytearray):
+    """Записує однозначне, незалежне від процесу представлення значення"""
+    if value is None:
+        out += b'N'
+    elif isinstance(value, bool):
+        out += b'T' if value else b'F'
+    elif isinstance(value, int):
+        out += b'i%d;' % value
+    elif isinstance(value, float):
+        out += b'f' + value.hex().encode() + b';'
+    elif isinstance(value, str):
+        data = value.encode()
+        out += b's%d:' % len(data) + data
+    elif isinstance(value, (bytes, bytearray)):
+        out += b'b%d:' % len(value) + value
+    elif isinstance(value, (tuple, list)):
+        out += b'(' if isinstance(value, tuple) else b'['
+        for item in value:
+            _canonical(item, out)
+        out += b')'
+    elif isinstance(value, (set, frozenset)):
+        out += b'{' + b''.join(sorted(canonical(item) for item in value)) + b'}'
+    elif isinstance(value, dict):
+        items = sorted(canonical(key) + canonical(item) for key, item in value.items())
+        out += b'<' + b''.join(items) + b'>'
+    elif isinstance(value, (datetime.date, datetime.time, datetime.timedelta, Decimal)):
+        data = repr(value).encode()
+        out += b'r%d:' % len(data) + data
+    elif isinstance(value, type):
+        out += b'c'
+        _canonical(_type_name(value), out)
+    elif isinstance(value, enum.Enum):
+        out += b'e'
+        _canonical((_type_name(type(value)), value.value), out)
+    elif hasattr(value, '__cache_key__'):
+        # Об'єкт сам визначає, що в ньому суттєве для кешу
+        out += b'k'
+        _canonical((_type_name(type(value)), value.__cache_key__()), out)
+    else:
+        # Інші об'єкти (зокрема self методів) - за класом і станом, як їх бачить pickle
+        try:
+            reduced = value.__reduce_ex__(4)
+        except TypeError:
+            raise ArgsUnhashable()
+        if isinstance(reduced, str):
+            reduced = (None, reduced)
+        out += b'o'
+        _canonical((_type_name(type(value)), *reduced[1:3]), out)
+
+
+def _type_name(cls) -> str:
+    return f'{cls.__module__}.{cls.__qualname__}'
+
+
+def _apply(func, args):
+    if isinstance(func, tuple):
+        # Процес пулу отримує (модуль, qualname): ім'я в модулі вказує на обгортку кешу
+        module, qualname = func
+        func = importlib.import_module(module)
+        for name in qualname.split('.'):
+            func = getattr(func, name)
+        func = getattr(func, '__wrapped__', func)
+    return func(*args)
+
+
+def _pool_target(func, executor):
+    """Функція для executor.map: для пулу процесів - посилання, яке можна передати pickle"""
+    if not isinstance(executor, ProcessPoolExecutor):
+        return func
+    if '<locals>' in func.__qualname__:
+        raise ValueError(f'{func.__qualname__} is not importable and cannot run in a process pool')
+    return func.__module__, func.__qualname__
+
+
+def canonical(value) -> bytes:
+    out = bytearray()
+    _canonical(value, out)
+    return bytes(out)
+
+
+def digest(value) -> str:
+    return hashlib.blake2b(canonical(value), digest_size=16).hexdigest()
+
+
+class Codec:
+    def __init__(self, codec_id: int, dumps, loads):
+        self.id = codec_id
+        self.dumps = dumps
+        self.loads = loads
+
+
+# Ідентифікатори записуються в заголовок значення, їх не можна змінювати
+CODECS = {
+    'pickle': Codec(1, lambda value: pickle.dumps(value, pickle.HIGHEST_PROTOCOL), pickle.loads),
+    'json': Codec(2, lambda value: json.dumps(value, separators=(',', ':')).encode(), json.loads),
+}
+if msgpack is not None:
+    CODECS['msgpack'] = Codec(3, msgpack.packb, msgpack.unpackb)
+
+COMPRESSORS = {
+    'zlib': Codec(1, zlib.compress, zlib.decompress),
+    'lzma': Codec(2, lzma.compress, lzma.decompress),
+}
+
+_CODECS_BY_ID = {codec.id: codec for codec in CODECS.values()}
+_COMPRESSORS_BY_ID = {compressor.id: compressor for compressor in COMPRESSORS.values()}
+
+# Значення зберігається як MAGIC, id кодека, id компресора (0 - без стиснення), дані.
+# pickle з протоколом >= 2 починається з 0x80, тому старі записи без заголовка розпізнаються
+MAGIC = 0xC0
+
+
+def encoder(codec='pickle', compress=None, compress_threshold=1024):
+    """Повертає функцію серіалізації значень вибраним кодеком зі стисненням великих значень"""
+    try:
+        value_codec = CODECS[codec]
+        compressor = COMPRESSORS[compress] if compress is not None else None
+    except KeyError as err:
+        raise ValueError(f'Unknown codec {err}')
+
+    def encode(value) -> bytes:
+        data = value_codec.dumps(value)
+        if compressor is not None and len(data) >= compress_threshold:
+            return bytes((MAGIC, value_codec.id, compressor.id)) + compressor.dumps(data)
+        return bytes((MAGIC, value_codec.id, 0)) + data
+
+    return encode
+
+
+# Значення з TTL мають додатковий заголовок: EXPIRY_MAGIC і момент, до якого значення свіже.
+# Після нього ключ живе ще stale_ttl секунд і віддається, поки фоном обчислюється нове
+EXPIRY_MAGIC = 0xC1
+_EXPIRY = struct.Struct('>d')
+
+
+def with_expiry(data: bytes, fresh_until: float) -> bytes:
+    return bytes((EXPIRY_MAGIC,)) + _EXPIRY.pack(fresh_until) + data
+
+
+def split_expiry(data: bytes):
+    """Повертає момент, до якого значення свіже (None - безстрокове), і саме значення"""
+    if data[0] != EXPIRY_MAGIC:
+        return None, data
+    return _EXPIRY.unpack_from(data, 1)[0], data[1 + _EXPIRY.size:]
+
+
+def decode(data: bytes):
+    _, data = split_expiry(data)
+    if data[0] != MAGIC:
+        return pickle.loads(data)
+    payload = data[3:]
+    if data[2]:
+        payload = _COMPRESSORS_BY_ID[data[2]].loads(payload)
+    return _CODECS_BY_ID[data[1]].loads(payload)
+
+
+class LocalCache:
+    """Обмежений кеш у пам'яті процесу (L1) перед Redis.
+
+    Зберігає серіалізовані значення: кожне влучання декодується в нову копію, тож зміна
+    повернутого об'єкта не псує кеш
+    """
+
+    def __init__(self, max_size=1024, max_bytes=None):
+        self.max_size = max_size
+        self.max_bytes = max_bytes
+        self.data = OrderedDict()
+        self.bytes = 0
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        with self.lock:
+            item = self.data.get(key)
+            if item is None:
+                return _MISSING
+            if item[2] is not None and item[2] < time.time():
+                self._pop(key)
+                return _MISSING
+            self.data.move_to_end(key)
+            return item[0]
+
+    def set(self, key, data, size, fresh_until=None):
+        if self.max_bytes is not None and size > self.max_bytes:
+            return
+        with self.lock:
+            self._pop(key)
+            self.data[key] = (data, size, fresh_until)
+            self.bytes += size
+            while len(self.data) > self.max_size or \
+                    (self.max_bytes is not None and self.bytes > self.max_bytes):
+                self._pop(next(iter(self.data)))
+
+    def discard(self, key):
+        with self.lock:
+            self._pop(key)
+
+    def clear(self):
+        with self.lock:
+            self.data.clear()
+            self.bytes = 0
+
+    def _pop(self, key):
+        item = self.data.pop(key, None)
+        if item is not None:
+            self.bytes -= item[1]
+
+
+# Верхні межі кошиків гістограми затримок запитів до Redis, у секундах
+LATENCY_BUCKETS = (0.0005, 0.001, 0.002, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 1.0)
+LATENCY_LABELS = tuple(f'latency_le_{bucket * 1000:g}ms' for bucket in LATENCY_BUCKETS) + ('latency_gt_1000ms',)
+
+
+# Таблиця для ділення всіх лічильників скетча навпіл одним bytes.translate()
+_HALVE = bytes(count >> 1 for count in range(256))
+
+
+class CountMinSketch:
+    """Оцінка частоти звернень до ключів для політики допуску TinyLFU.
+
+    depth (до 8) рядків лічильників по width байт з насиченням на 255. Після 10 * width
+    звернень усі лічильники діляться навпіл, тож давня популярність поступово забувається.
+    """
+
+    def __init__(self, width=2 ** 16, depth=4):
+        self.mask = (1 << max(width - 1, 1).bit_length()) - 1
+        self.rows = [bytearray(self.mask + 1) for _ in range(depth)]
+        self.additions = 0
+        self.sample_size = 10 * (self.mask + 1)
+        self.lock = threading.Lock()
+
+    def _indexes(self, key):
+        # Незалежні 8-байтові частини одного blake2b на кожен рядок: ключі, що збіглися в
+        # одному рядку, в інших рядках розходяться
+        data = key.encode() if isinstance(key, str) else repr(key).encode()
+        digest = hashlib.blake2b(data, digest_size=8 * len(self.rows)).digest()
+        return [int.from_bytes(digest[offset:offset + 8], 'little') & self.mask
+                for offset in range(0, len(digest), 8)]
+
+    def increment(self, key):
+        with self.lock:
+            for row, index in zip(self.rows, self._indexes(key)):
+                if row[index] < 255:
+                    row[index] += 1
+            self.additions += 1
+            if self.additions >= self.sample_size:
+                self.rows = [bytearray(row.translate(_HALVE)) for row in self.rows]
+                self.additions //= 2
+
+    def estimate(self, key):
+        return min(row[index] for row, index in zip(self.rows, self._indexes(key)))
+
+    def admit(self, candidate, victim):
+        """Чи варто витіснити victim заради candidate"""
+        return self.estimate(candidate) > self.estimate(victim)
+
+
+class CacheStats:
+    """Лічильники звернень і гістограма затримок Redis для однієї декорованої функції.
+
+    Лічильники: l1_hits, l2_hits, misses, evictions, bytes_written, compute_seconds,
+    redis_calls, redis_seconds. Зміни з моменту останнього flush() можна додати до
+    спільного hash у Redis, щоб зібрати статистику всіх процесів.
+    """
+
+    def __init__(self, name):
+        self.name = name
+        self.counters = Counter()
+        self.unflushed = Counter()
+        self.lock = threading.Lock()
+
+    def add(self, **values):
+        with self.lock:
+            self.counters.update(values)
+            self.unflushed.update(values)
+
+    def observe(self, seconds):
+        label = LATENCY_LABELS[bisect.bisect_left(LATENCY_BUCKETS, seconds)]
+        self.add(redis_calls=1, redis_seconds=seconds, **{label: 1})
+
+    def snapshot(self):
+        with self.lock:
+            result = {label: 0 for label in LATENCY_LABELS}
+            result.update(self.counters)
+        total = result.get('l1_hits', 0) + result.get('l2_hits', 0) + result.get('misses', 0)
+        result['hit_ratio'] = (total - result.get('misses', 0)) / total if total else 0.0
+        return result
+
+    def reset(self):
+        """Починає статистику з нуля; після fork - щоб не передати в Redis лічильники батька вдруге"""
+        self.lock = threading.Lock()
+        self.counters = Counter()
+        self.unflushed = Counter()
+
+    def pop_unflushed(self):
+        with self.lock:
+            values, self.unflushed = self.unflushed, Counter()
+        return values
+
+    def flush(self, pipeline, key):
+        """Додає незбережені зміни до hash key через pipeline; execute() викликає власник"""
+        for field, value in self.pop_unflushed().items():
+            if isinstance(value, float):
+                pipeline.hincrbyfloat(key, field, value)
+            else:
+                pipeline.hincrby(key, field, value)
+
+
+class CachedFunction:
+    """Декорована функція разом з її побудовою ключів, кодеком, TTL і статистикою"""
+
+    def __init__(self, func, namespace, make_suffix, encode, ttl, stats: CacheStats):
+        self.func = func
+        self.namespace = namespace
+        self.version_key = f'{namespace}:Version'
+        # Токен версії з Redis; None - ще невідомий, його поверне перше ж читання
+        self.version = None
+        self.make_suffix = make_suffix
+        self.encode = encode
+        self.ttl = ttl
+        self.stats = stats
+
+    def key(self, suffix):
+        return f'{self.namespace}:v{self.version}:{suffix}'
+
+    def make_key(self, *args, **kwargs):
+        return self.key(self.make_suffix(*args, **kwargs))
+
+
+class BaseLRU:
+    """Спільні для синхронного та асинхронного кешу ключі, скрипти і формат збереження"""
+
+    def __init__(self, client,
                  max_size=2 ** 20,
                  key_prefix='MyRedisLRU',
-                 clear_on_start=False):
+                 max_bytes=None,
+                 max_value_bytes=None,
+                 codec='pickle',
+                 compress=None,
+                 compress_threshold=1024,
+                 single_flight=False,
+                 lock_timeout=10.0,
+                 wait_timeout=10.0,
+                 poll_interval=0.01,
+                 ttl=None,
+                 stale_ttl=0,
+                 stats_to_redis=False,
+                 stats_interval=5.0,
+                 admission=False):
         self.client = client
         self.max_size = max_size
         self.key_prefix = key_prefix
+        # Бюджет сумарного розміру серіалізованих значень і найбільше значення, що потрапляє в кеш
+        self.max_bytes = max_bytes
+        self.max_value_bytes = max_value_bytes
+        self.codec = codec
+        self.compress = compress
+        self.compress_threshold = compress_threshold
+        self.encode = encoder(codec, compress, compress_threshold)
+        # Single-flight: при промаху функцію виконує лише власник блокування ключа, інші чекають
+        # на результат не довше wait_timeout. Блокування живе lock_timeout секунд, тому після
+        # падіння власника його перехоплює наступний процес
+        self.single_flight = single_flight
+        self.lock_timeout = lock_timeout
+        self.wait_timeout = wait_timeout
+        self.poll_interval = poll_interval
+        # Час свіжості значень у секундах і вікно, у якому застаріле значення ще віддається
+        # одразу, поки нове обчислюється у фоні (stale-while-revalidate)
+        self.ttl = ttl
+        self.stale_ttl = stale_ttl
+        # Порядок використання зберігається у sorted set: score - значення лічильника звернень
+        self.lru_key = f'{key_prefix}:LRU'
+        self.clock_key = f'{key_prefix}:Clock'
+        self.sizes_key = f'{key_prefix}:Sizes'
+        self.bytes_key = f'{key_prefix}:Bytes'
+        self.epoch_key = f'{key_prefix}:Epoch'
+        self.get_script = self.client.register_script(GET_SCRIPT)
+        self.set_script = self.client.register_script(SET_SCRIPT)
+        self.trim_script = self.client.register_script(TRIM_SCRIPT)
+        self.release_script = self.client.register_script(RELEASE_SCRIPT)
+        self.get_many_script = self.client.register_script(GET_MANY_SCRIPT)
+        self.drop_script = self.client.register_script(DROP_SCRIPT)
+        self.channel = f'{key_prefix}:Invalidate'
+        self.origin = uuid.uuid4().hex
+        # Декоровані функції за іменем; при stats_to_redis їхня статистика раз на
+        # stats_interval секунд додається до hash <key_prefix>:Stats:<функція>
+        self.functions = {}
+        self.stats_to_redis = stats_to_redis
+        self.stats_interval = stats_interval
+        self.stats_flushed = time.monotonic()
+        # TinyLFU: новий запис потрапляє в повний кеш, лише якщо за оцінкою локального
+        # скетча до нього звертаються частіше, ніж до кандидата на витіснення
+        self.sketch = CountMinSketch(min(max_size, 2 ** 20)) if admission else None
+        if hasattr(os, 'register_at_fork'):
+            # Слабке посилання, щоб обробник fork не тримав кеш живим
+            ref = weakref.ref(self)
+            os.register_at_fork(after_in_child=lambda: ref() is not None and ref()._after_fork())
+
+    def _after_fork(self):
+        """Стан процесу, який не можна успадкувати від батьківського"""
+        # Інакше батько ігноруватиме повідомлення дочірнього процесу як власні
+        self.origin = uuid.uuid4().hex
+        for fn in self.functions.values():
+            fn.stats.reset()
+        if self.sketch is not None:
+            self.sketch.lock = threading.Lock()
+
+    def key_maker(self, func: types.FunctionType, key_func=None):
+        """Повертає функцію, що будує суфікс ключа кешу (після простору імен і версії) для виклику func.
+
+        Без key_func аргументи прив'язуються до сигнатури func (позиційні та іменовані
+        виклики дають той самий ключ), серіалізуються канонічно і хешуються blake2b.
+        Enum береться за значенням, об'єкт з методом __cache_key__() - за його результатом,
+        інші об'єкти (зокрема self методу) - за класом і станом з __reduce_ex__, тож рівні
+        за станом екземпляри мають спільний запис. Аргумент, який pickle не серіалізує,
+        дає ArgsUnhashable - для таких функцій потрібен key_func(*args, **kwargs), що
+        повертає рядок, який підставляється замість хешу.
+        """
+        if key_func is not None:
+            return lambda *args, **kwargs: str(key_func(*args, **kwargs))
+
+        try:
+            signature = inspect.signature(func)
+        except (TypeError, ValueError):
+            signature = None
+
+        def make_key(*args, **kwargs):
+            arguments = (args, kwargs)
+            if signature is not None:
+                try:
+                    bound = signature.bind(*args, **kwargs)
+                    bound.apply_defaults()
+                    arguments = bound.arguments
+                except TypeError:
+                    pass
+            return digest(arguments)
+
+        return make_key
+
+    def cached_function(self, func, key_func=None, codec=None, compress=_MISSING, ttl=_MISSING):
+        name = f'{func.__module__}:{func.__qualname__}'
+        stats = self.functions[name].stats if name in self.functions else CacheStats(name)
+        fn = CachedFunction(func, f'{self.key_prefix}:{name}', self.key_maker(func, key_func),
+                            self.encoder(codec, compress), self.ttl if ttl is _MISSING else ttl, stats)
+        self.functions[name] = fn
+        return fn
+
+    def _function(self, func) -> CachedFunction:
+        return self.functions[f'{func.__module__}:{func.__qualname__}']
+
+    def encoder(self, codec=None, compress=_MISSING):
+        """Функція серіалізації для окремої функції; None/_MISSING - налаштування кешу"""
+        if codec is None and compress is _MISSING:
+            return self.encode
+        return encoder(codec or self.codec,
+                       self.compress if compress is _MISSING else compress,
+                       self.compress_threshold)
+
+    decode = staticmethod(decode)
+
+    def get(self, key, fn: CachedFunction):
+        """Повертає серіалізоване значення і оновлює його позицію в LRU за один запит.
+
+        Скрипт повертає список з актуальним токеном версії, якщо версія fn застаріла
+        """
+        return self.get_script(keys=[*self._script_keys(key), self.epoch_key, fn.version_key],
+                               args=[fn.version or ''])
+
+    def _get_many_keys(self, fn: CachedFunction, keys):
+        return [self.lru_key, self.clock_key, self.epoch_key, fn.version_key, *keys]
+
+    def _versions_pipeline(self, fn: CachedFunction):
+        pipeline = self.client.pipeline(transaction=False)
+        pipeline.incr(fn.version_key)
+        pipeline.publish(self.channel, f'!\n{fn.namespace}')
+        fn.version = None
+        return pipeline
+
+    def _clear_pipeline(self):
+        # MULTI: запис між зміною епохи і видаленням списку не лишиться в новому списку без розміру
+        pipeline = self.client.pipeline()
+        pipeline.incr(self.epoch_key)
+        pipeline.unlink(self.lru_key, self.sizes_key, self.bytes_key)
+        pipeline.publish(self.channel, '!\n*')
+        for fn in self.functions.values():
+            fn.version = None
+        return pipeline
+
+    def _set_version(self, namespace, version=None):
+        for fn in self.functions.values():
+            if namespace in ('*', fn.namespace):
+                fn.version = version
+
+    def prepare(self, data: bytes, ttl=None):
+        """Додає до значення заголовок свіжості, повертає значення і час життя ключа в мс"""
+        if ttl is None:
+            return data, 0
+        return with_expiry(data, time.time() + ttl), int((ttl + self.stale_ttl) * 1000)
+
+    def fits(self, data: bytes) -> bool:
+        """Чи не перевищує підготовлене значення max_value_bytes і весь бюджет max_bytes.
+
+        Значення, більше за max_bytes, витіснило б увесь кеш разом із собою
+        """
+        return all(limit is None or len(data) <= limit for limit in (self.max_value_bytes, self.max_bytes))
+
+    def store(self, key, data: bytes, ttl_ms=0, check_admission=False):
+        """Записує підготовлене prepare() значення і витісняє зайві записи за один запит.
+
+        Повертає кількість витіснених записів. З check_admission у повному кеші повертає
+        список з кандидатом на витіснення. Розмір значення перевіряє fits() до виклику.
+        """
+        return self.set_script(keys=self._script_keys(key),
+                               args=self._script_args(data, ttl_ms, check_admission))
+
+    @staticmethod
+    def sketch_key(key: str) -> str:
+        """Ключ без токена версії: частота звернень не скидається після invalidate()"""
+        return VERSIONED_KEY.sub(r'\1:', key, count=1)
+
+    def record(self, fn: CachedFunction, suffix):
+        if self.sketch is not None:
+            self.sketch.increment(f'{fn.namespace}:{suffix}')
+
+    def admitted(self, key, victims) -> bool:
+        return self.sketch.admit(self.sketch_key(key), self.sketch_key(victims[0].decode()))
+
+    def _lock(self, key):
+        return f'{key}:Lock', uuid.uuid4().hex, int(self.lock_timeout * 1000)
+
+    def _script_keys(self, key):
+        return [key, self.lru_key, self.clock_key, self.sizes_key, self.bytes_key]
+
+    def _script_args(self, data=b'', ttl_ms=0, check_admission=False):
+        return [data, self.max_size, self.channel, self.origin, self.max_bytes or 0, ttl_ms,
+                '1' if check_admission else '0']
+
+    def stats(self):
+        """Статистика цього процесу для кожної декорованої функції"""
+        return {name: fn.stats.snapshot() for name, fn in self.functions.items()}
+
+    def stats_key(self, name):
+        return f'{self.key_prefix}:Stats:{name}'
+
+    def flush_due(self):
+        if not self.stats_to_redis or time.monotonic() - self.stats_flushed < self.stats_interval:
+            return False
+        self.stats_flushed = time.monotonic()
+        return True
+
+    def _flush_pipeline(self):
+        pipeline = self.client.pipeline(transaction=False)
+        for name, fn in self.functions.items():
+            fn.stats.flush(pipeline, self.stats_key(name))
+        return pipeline
+
+    def hit_ratios(self):
+        """Частка звернень, обслужених кожним рівнем кешу"""
+        totals = Counter()
+        for fn in self.functions.values():
+            totals.update(fn.stats.snapshot())
+        l1_hits, l2_hits, misses = totals['l1_hits'], totals['l2_hits'], totals['misses']
+        total = l1_hits + l2_hits + misses
+        return {'l1_hits': l1_hits, 'l2_hits': l2_hits, 'misses': misses,
+                'l1_ratio': l1_hits / total if total else 0.0,
+                'l2_ratio': l2_hits / total if total else 0.0}
+
+
+class MyLRU(BaseLRU):
+    """Синхронний LRU-кеш у Redis.
+
+    Модель паралельності. Кожна зміна спільного стану (запис, витіснення, читання з
+    оновленням позиції, очищення версій) виконується одним Lua-скриптом, тож Redis бачить
+    її атомарною, а список LRU, hash розмірів і значення не розходяться за будь-якої
+    кількості потоків і процесів. Один екземпляр можна використовувати з багатьох потоків:
+    клієнт redis-py бере з'єднання з пулу на кожен запит, а локальні L1, статистика і скетч
+    захищені блокуваннями. Процесам варто створювати кеш через from_url() зі спільним пулом.
+    Після fork дочірній процес відкриває власні з'єднання, очищує L1, заново підписується
+    на канал інвалідації і отримує новий ідентифікатор. check_invariants() перевіряє
+    узгодженість стану в Redis, коли записи зупинено.
+    """
+
+    def __init__(self, client: redis.Redis,
+                 max_size=2 ** 20,
+                 key_prefix='MyRedisLRU',
+                 clear_on_start=False,
+                 l1_size=0,
+                 l1_max_bytes=None,
+                 **options):
+        super().__init__(client, max_size, key_prefix, **options)
+
+        # L1 узгоджується з іншими процесами через повідомлення про записані та витіснені ключі
+        self.l1 = None
+        if l1_size > 0:
+            self.l1 = LocalCache(l1_size, l1_max_bytes)
+            self._subscribe()
 
         if clear_on_start:
-            self.client.flushdb()
-        elif self.client.exists('CashList'):
-            while self.client.llen('CashList') > self.max_size:
-                key = self.client.rpop('CashList')
-                self.client.delete(key)
+            self.clear()
+        else:
+            self.migrate_cash_list()
+            self.trim()
+
+    @classmethod
+    def from_url(cls, url='redis://localhost:6379/0', pool_options=None, **options):
+        """Кеш на спільному для процесу пулі з'єднань connection_pool(url, **pool_options)"""
+        return cls(redis.Redis(connection_pool=connection_pool(url, **(pool_options or {}))), **options)
+
+    def _subscribe(self):
+        self.pubsub = self.client.pubsub(ignore_subscribe_messages=True)
+        self.pubsub.subscribe(**{self.channel: self._invalidate})
+        self.listener = self.pubsub.run_in_thread(sleep_time=0.01, daemon=True)
+
+    def _after_fork(self):
+        super()._after_fork()
+        if self.l1 is not None:
+            # Потік слухача не переживає fork: без нового підписника L1 застаріє
+            self.l1 = LocalCache(self.l1.max_size, self.l1.max_bytes)
+            self._subscribe()
+
+    def __call__(self, func=None, *, key_func=None, codec=None, compress=_MISSING, ttl=_MISSING):
+        if func is None:
+            return lambda f: self(f, key_func=key_func, codec=codec, compress=compress, ttl=ttl)
+        fn = self.cached_function(func, key_func, codec, compress, ttl)
+
+        def call(ttl, *args, **kwargs):
+            return self.call(fn, ttl, fn.make_suffix(*args, **kwargs), *args, **kwargs)
 
-    def __call__(self, func):
         @wraps(func)
         def wrapper(*args, **kwargs):
-            key = self._decorator_key(func, *args, **kwargs)
-            if self.client.exists(key):
-                result = self.client.get(key)
-                result = pickle.loads(result)
-                self.move_up(key)
-            else:
-                result = func(*args, **kwargs)
-                self.add(key, result)
+            return call(fn.ttl, *args, **kwargs)
+
+        # fibonacci_cache.with_ttl(60)(n) - виклик з власним TTL
+        wrapper.with_ttl = lambda call_ttl: lambda *args, **kwargs: call(call_ttl, *args, **kwargs)
+        wrapper.stats = fn.stats.snapshot
+        # fibonacci_cache.map(range(100)) - пакетне обчислення
+        wrapper.map = lambda iterable, executor=None: self.map(fn, iterable, executor)
+        wrapper.invalidate = lambda: self.invalidate(fn)
+        return wrapper
+
+    def call(self, fn: CachedFunction, ttl, suffix, *args, **kwargs):
+        """Повертає результат fn для аргументів, суфікс ключа яких уже обчислено"""
+        self.record(fn, suffix)
+        if self.l1 is not None:
+            data = self.l1.get(fn.key(suffix))
+            if data is not _MISSING:
+                fn.stats.add(l1_hits=1)
+                return self.decode(data)
+
+        key, data = self.lookup(fn, suffix)
+        if data is None:
+            fn.stats.add(misses=1)
+            result, data = self.compute(fn, key, ttl, *args, **kwargs)
+        else:
+            fn.stats.add(l2_hits=1)
+            result = self.decode(data)
+
+        fresh_until, _ = split_expiry(data)
+        if fresh_until is not None and fresh_until < time.time():
+            self.revalidate(fn, key, ttl, *args, **kwargs)
+        elif self.l1 is not None:
+            self.l1.set(key, data, len(data), fresh_until)
+        if self.flush_due():
+            self.flush_stats()
+        return result
+
+    def lookup(self, fn: CachedFunction, suffix):
+        """Читає запис за суфіксом, повторюючи читання, якщо версія функції змінилася"""
+        version = fn.version
+        key = fn.key(suffix)
+        data = self.get(key, fn)
+        if data is None and fn.version != version:
+            key = fn.key(suffix)
+            data = self.get(key, fn)
+        return key, data
+
+    def invalidate(self, func):
+        """Робить недосяжними всі записи функції за O(1), старі записи прибираються у фоні"""
+        fn = func if isinstance(func, CachedFunction) else self._function(func)
+        self._versions_pipeline(fn).execute()
+        self.cleanup(f'{fn.namespace}:v*')
+
+    def clear(self, background=True):
+        """Робить недосяжними всі записи кешу за O(1), старі записи прибираються у фоні.
+
+        З background=False прибирання завершується до повернення з методу
+        """
+        self.drop_legacy()
+        self._clear_pipeline().execute()
+        self.cleanup(background=background)
+
+    def cleanup(self, match=None, batch_size=1000, background=True):
+        """Видаляє записи застарілих версій через SCAN + UNLINK пакетами по batch_size"""
+        def run():
+            versions, batch = {}, []
+            for key in self.client.scan_iter(match=match or f'{self.key_prefix}:*', count=batch_size):
+                found = VERSIONED_KEY.match(key.decode())
+                if found is None:
+                    continue
+                namespace, version = found.groups()
+                if namespace not in versions:
+                    epoch, current = self.client.mget(self.epoch_key, f'{namespace}:Version')
+                    versions[namespace] = f'{int(epoch or 0)}.{int(current or 0)}'
+                if version != versions[namespace]:
+                    batch.append(key)
+                if len(batch) >= batch_size:
+                    self.drop_script(keys=[self.lru_key, self.sizes_key, self.bytes_key, *batch])
+                    batch = []
+            if batch:
+                self.drop_script(keys=[self.lru_key, self.sizes_key, self.bytes_key, *batch])
+
+        if background:
+            threading.Thread(target=run, daemon=True).start()
+        else:
+            run()
+
+    def map(self, fn: CachedFunction, iterable, executor=None):
+        """Повертає список результатів fn для кожного набору аргументів з iterable.
+
+        Елемент iterable - кортеж позиційних аргументів або один аргумент. Збережені значення
+        читаються одним запитом, промахи обчислюються (в executor, якщо він переданий) і
+        записуються одним pipeline. ThreadPoolExecutor підходить для будь-якої функції;
+        ProcessPoolExecutor - лише для функцій, доступних за іменем на рівні модуля.
+        """
+        calls = [args if isinstance(args, tuple) else (args,) for args in iterable]
+        return self.map_suffixes(fn, calls, [fn.make_suffix(*args) for args in calls], executor)
+
+    def map_suffixes(self, fn: CachedFunction, calls, suffixes, executor=None):
+        keys = [fn.key(suffix) for suffix in suffixes]
+        for suffix in suffixes:
+            self.record(fn, suffix)
+        results = [_MISSING] * len(calls)
+        if self.l1 is not None:
+            results = [self.l1.get(key) for key in keys]
+            results = [result if result is _MISSING else self.decode(result) for result in results]
+            fn.stats.add(l1_hits=sum(result is not _MISSING for result in results))
+
+        pending = [index for index, result in enumerate(results) if result is _MISSING]
+        start = time.perf_counter()
+        found = self.get_many(fn, [keys[index] for index in pending])
+        if found is None:
+            # Версія функції змінилася - перебудовуємо ключі і читаємо ще раз
+            keys = [fn.key(suffix) for suffix in suffixes]
+            found = self.get_many(fn, [keys[index] for index in pending]) or [None] * len(pending)
+        fn.stats.observe(time.perf_counter() - start)
+        misses = []
+        for index, data in zip(pending, found):
+            if data is None:
+                misses.append(index)
+                continue
+            results[index] = self.decode(data)
+            fresh_until, _ = split_expiry(data)
+            if fresh_until is not None and fresh_until < time.time():
+                self.revalidate(fn, keys[index], fn.ttl, *calls[index])
+            elif self.l1 is not None:
+                self.l1.set(keys[index], data, len(data), fresh_until)
+        fn.stats.add(l2_hits=len(pending) - len(misses), misses=len(misses))
+        if not misses:
+            return results
+
+        start = time.perf_counter()
+        if executor is None:
+            computed = [fn.func(*calls[index]) for index in misses]
+        else:
+            computed = list(executor.map(_apply, itertools.repeat(_pool_target(fn.func, executor)),
+                                         [calls[index] for index in misses]))
+        fn.stats.add(compute_seconds=time.perf_counter() - start)
+
+        writes = []
+        for index, result in zip(misses, computed):
+            results[index] = result
+            data, ttl_ms = self.prepare(fn.encode(result), fn.ttl)
+            if self.fits(data):
+                writes.append((keys[index], data, ttl_ms))
+        check_admission = self.sketch is not None
+        while writes:
+            pipeline = self.client.pipeline(transaction=False)
+            for key, data, ttl_ms in writes:
+                self.set_script(keys=self._script_keys(key), args=self._script_args(data, ttl_ms, check_admission),
+                                client=pipeline)
+            start = time.perf_counter()
+            replies = pipeline.execute()
+            fn.stats.observe(time.perf_counter() - start)
+            # Записи, яким скетч надав допуск, дописуються другим pipeline без перевірки
+            admitted = []
+            for write, reply in zip(writes, replies):
+                if not isinstance(reply, list):
+                    fn.stats.add(evictions=reply, bytes_written=len(write[1]))
+                elif self.admitted(write[0], reply):
+                    admitted.append(write)
+                else:
+                    fn.stats.add(rejections=1)
+            writes, check_admission = admitted, False
+        return results
+
+    def get_many(self, fn: CachedFunction, keys, chunk_size=1000):
+        """Повертає збережені значення для keys одним pipeline (None для відсутніх).
+
+        Якщо версія fn застаріла, оновлює її і повертає None
+        """
+        if not keys:
+            return []
+        pipeline = self.client.pipeline(transaction=False)
+        for start in range(0, len(keys), chunk_size):
+            self.get_many_script(keys=self._get_many_keys(fn, keys[start:start + chunk_size]),
+                                 args=[fn.version or ''], client=pipeline)
+        chunks = pipeline.execute()
+        for chunk in chunks:
+            if not isinstance(chunk, list):
+                fn.version = chunk.decode()
+                return None
+        return [data for chunk in chunks for data in chunk]
+
+    def get(self, key, fn: CachedFunction):
+        start = time.perf_counter()
+        data = super().get(key, fn)
+        fn.stats.observe(time.perf_counter() - start)
+        if isinstance(data, list):
+            fn.version = data[0].decode()
+            return None
+        return data
+
+    def compute(self, fn: CachedFunction, key, ttl, *args, **kwargs):
+        """Обчислює і записує значення при промаху, повертає значення і його серіалізацію"""
+        if not self.single_flight:
+            return self.compute_and_add(fn, key, ttl, *args, **kwargs)
+
+        deadline = time.monotonic() + self.wait_timeout
+        lock_key, token, lock_ms = self._lock(key)
+        while True:
+            if self.client.set(lock_key, token, nx=True, px=lock_ms):
+                try:
+                    # Попередній власник міг записати значення між нашим промахом і блокуванням
+                    data = self.get(key, fn)
+                    if data is not None:
+                        return self.decode(data), data
+                    return self.compute_and_add(fn, key, ttl, *args, **kwargs)
+                finally:
+                    self.release_script(keys=[lock_key], args=[token])
+
+            while self.client.exists(lock_key):
+                if time.monotonic() > deadline:
+                    return self.compute_and_add(fn, key, ttl, *args, **kwargs)
+                time.sleep(self.poll_interval)
+            data = self.get(key, fn)
+            if data is not None:
+                return self.decode(data), data
+            # Власник завершився без запису (помилка, завелике значення) - пробуємо взяти блокування
+
+    def compute_and_add(self, fn: CachedFunction, key, ttl, *args, **kwargs):
+        start = time.perf_counter()
+        result = fn.func(*args, **kwargs)
+        fn.stats.add(compute_seconds=time.perf_counter() - start)
+        return result, self.add(key, result, fn, ttl)
+
+    def revalidate(self, fn: CachedFunction, key, ttl, *args, **kwargs):
+        """Запускає фонове оновлення застарілого значення, якщо його ще ніхто не оновлює"""
+        lock_key, token, lock_ms = self._lock(key)
+        if not self.client.set(lock_key, token, nx=True, px=lock_ms):
+            return
+
+        def refresh():
+            try:
+                self.compute_and_add(fn, key, ttl, *args, **kwargs)
+            finally:
+                self.release_script(keys=[lock_key], args=[token])
+
+        threading.Thread(target=refresh, daemon=True).start()
+
+    def add(self, key, value, fn: CachedFunction = None, ttl=None):
+        """Записує значення і витісняє зайві записи за один запит, повертає збережене значення"""
+        data, ttl_ms = self.prepare((fn.encode if fn else self.encode)(value), ttl)
+        if not self.fits(data):
+            return data
+        start = time.perf_counter()
+        evicted = self.store(key, data, ttl_ms, self.sketch is not None)
+        if isinstance(evicted, list):
+            # Повний кеш: другий запит лише якщо скетч надав допуск
+            evicted = self.store(key, data, ttl_ms) if self.admitted(key, evicted) else None
+            if evicted is None and fn is not None:
+                fn.stats.add(rejections=1)
+        if fn is not None:
+            fn.stats.observe(time.perf_counter() - start)
+            if evicted is not None:
+                fn.stats.add(evictions=evicted, bytes_written=len(data))
+        return data
+
+    def flush_stats(self):
+        """Додає статистику цього процесу до спільних hash у Redis"""
+        self._flush_pipeline().execute()
+
+    def redis_stats(self):
+        """Статистика всіх процесів, зібрана в Redis"""
+        return {name: {field.decode(): float(value)
+                       for field, value in self.client.hgetall(self.stats_key(name)).items()}
+                for name in self.functions}
 
+    def _invalidate(self, message):
+        origin, *keys = message['data'].decode().split('\n')
+        if origin == self.origin:
+            return
+        if origin == '!':
+            # Змінилася версія функції (або епоха кешу для '*'): старі ключі L1 стають недосяжними
+            self._set_version(keys[0])
+            return
+        for key in keys:
+            self.l1.discard(key)
+
+    def check_invariants(self, batch_size=1000):
+        """Перевіряє узгодженість списку LRU, розмірів і значень у Redis.
+
+        Повертає словник порушень (порожній, якщо все гаразд). Має сенс, коли записи
+        зупинено: скрипти змінюють стан атомарно, але сама перевірка читає його кількома запитами.
+        Без TTL кожен ключ зі списку має існувати; записи з TTL зникають до наступного читання.
+        """
+        listed = {key for key, _ in self.client.zscan_iter(self.lru_key, count=batch_size)}
+        sizes = {key: int(size) for key, size in self.client.hgetall(self.sizes_key).items()}
+        total = int(self.client.get(self.bytes_key) or 0)
+        violations = {}
+        if len(listed) > self.max_size:
+            violations['over_max_size'] = len(listed)
+        if set(sizes) != listed:
+            violations['sizes_mismatch'] = sorted(set(sizes) ^ listed)
+        if total != sum(sizes.values()):
+            violations['bytes_mismatch'] = (total, sum(sizes.values()))
+        if self.max_bytes is not None and total > self.max_bytes:
+            violations['over_max_bytes'] = total
+
+        keys = sorted(listed)
+        missing = []
+        for start in range(0, len(keys), batch_size):
+            pipeline = self.client.pipeline(transaction=False)
+            for key in keys[start:start + batch_size]:
+                pipeline.pttl(key)
+            missing += [key for key, ttl in zip(keys[start:start + batch_size], pipeline.execute()) if ttl == -2]
+        if missing and self.ttl is None and all(fn.ttl is None for fn in self.functions.values()):
+            violations['missing_values'] = missing
+
+        # Значення актуальної версії, яких немає у списку, вже ніколи не будуть витіснені
+        versions, unlisted = {}, []
+        for key in self.client.scan_iter(match=f'{self.key_prefix}:*', count=batch_size):
+            found = VERSIONED_KEY.match(key.decode())
+            if found is None or key in listed or key.endswith(b':Lock'):
+                continue
+            namespace, version = found.groups()
+            if namespace not in versions:
+                epoch, current = self.client.mget(self.epoch_key, f'{namespace}:Version')
+                versions[namespace] = f'{int(epoch or 0)}.{int(current or 0)}'
+            if version == versions[namespace]:
+                unlisted.append(key)
+        if unlisted:
+            violations['unlisted_values'] = unlisted
+        return violations
+
+    def trim(self, chunk_size=10_000):
+        """Видаляє найдавніше використані записи понад max_size і max_bytes пакетами по chunk_size"""
+        size, evicted = self.client.zcard(self.lru_key), 0
+        while True:
+            target = max(self.max_size, size - chunk_size)
+            args = self._script_args()
+            args[1] = target
+            count = self.trim_script(keys=self._script_keys(self.lru_key), args=args)
+            evicted, size = evicted + count, size - count
+            if target == self.max_size:
+                return evicted
+
+    def migrate_cash_list(self, chunk_size=10_000):
+        """Переносить записи зі старого списку CashList у sorted set.
+
+        Голова списку - найсвіжіший запис, тому він отримує найбільший score.
+        Перенесені записи мають від'ємні score і вважаються старшими за нові.
+        """
+        if self.client.type('CashList') != b'list':
+            return
+        length = self.client.llen('CashList')
+        for start in range(0, length, chunk_size):
+            keys = self.client.lrange('CashList', start, start + chunk_size - 1)
+            mapping = {key: -(start + index) for index, key in enumerate(keys)}
+            # nx - дублікат ключа далі у списку старший, його score не потрібен
+            self.client.zadd(self.lru_key, mapping, nx=True)
+        self.client.delete('CashList')
+
+    def drop_legacy(self, chunk_size=10_000):
+        """Видаляє значення старого формату: зі списку CashList і перенесені з нього в sorted set.
+
+        Ключі без токена версії cleanup() не прибирає, тож без цього clear() лишив би їх назавжди
+        """
+        if self.client.type('CashList') == b'list':
+            while keys := self.client.lrange('CashList', 0, chunk_size - 1):
+                self.client.unlink(*keys)
+                self.client.ltrim('CashList', len(keys), -1)
+            self.client.delete('CashList')
+        # Перенесені migrate_cash_list() записи мають score <= 0, нові - додатний
+        while keys := self.client.zrangebyscore(self.lru_key, '-inf', 0, start=0, num=chunk_size):
+            self.drop_script(keys=[self.lru_key, self.sizes_key, self.bytes_key, *keys])
+
+
+class HashRing:
+    """Консистентне хешування з віртуальними вузлами: додавання вузла переносить ~1/n ключів"""
+
+    def __init__(self, names, replicas=100):
+        self.names = list(names)
+        points = sorted((self.hash(f'{name}#{replica}'), index)
+                        for index, name in enumerate(self.names) for replica in range(replicas))
+        self.points = [point for point, _ in points]
+        self.nodes = [index for _, index in points]
+
+    @staticmethod
+    def hash(value: str) -> int:
+        return int.from_bytes(hashlib.blake2b(value.encode(), digest_size=8).digest(), 'big')
+
+    def node(self, key: str) -> int:
+        """Індекс вузла, відповідального за key"""
+        position = bisect.bisect(self.points, self.hash(key)) % len(self.points)
+        return self.nodes[position]
+
+
+class ShardedMyLRU:
+    """MyLRU, розподілений між кількома Redis консистентним хешуванням суфікса ключа.
+
+    Кожен вузол - окремий MyLRU з власним LRU, бюджетом (max_size і max_bytes ділиться
+    порівну) і версіями функцій. Записи однієї функції розподіляються між усіма вузлами.
+    """
+
+    def __init__(self, clients,
+                 max_size=2 ** 20,
+                 key_prefix='MyRedisLRU',
+                 names=None,
+                 replicas=100,
+                 **options):
+        names = names or [self.client_name(client) for client in clients]
+        if options.get('max_bytes'):
+            options['max_bytes'] //= len(clients)
+        self.shards = [MyLRU(client, max(1, max_size // len(clients)), key_prefix, **options)
+                       for client in clients]
+        self.ring = HashRing(names, replicas)
+
+    @staticmethod
+    def client_name(client: redis.Redis):
+        kwargs = client.connection_pool.connection_kwargs
+        return f"{kwargs.get('host', 'localhost')}:{kwargs.get('port', 6379)}/{kwargs.get('db', 0)}"
+
+    def __call__(self, func=None, **function_options):
+        if func is None:
+            return lambda f: self(f, **function_options)
+        for shard in self.shards:
+            shard(func, **function_options)
+        fns = [shard._function(func) for shard in self.shards]
+        make_suffix = fns[0].make_suffix
+
+        def call(ttl, *args, **kwargs):
+            suffix = make_suffix(*args, **kwargs)
+            index = self.ring.node(suffix)
+            return self.shards[index].call(fns[index], ttl, suffix, *args, **kwargs)
+
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            return call(fns[0].ttl, *args, **kwargs)
+
+        wrapper.with_ttl = lambda call_ttl: lambda *args, **kwargs: call(call_ttl, *args, **kwargs)
+        wrapper.stats = lambda: self.function_stats(fns)
+        wrapper.map = lambda iterable, executor=None: self.map(fns, iterable, executor)
+        wrapper.invalidate = lambda: [shard.invalidate(fn) for shard, fn in zip(self.shards, fns)]
+        return wrapper
+
+    def map(self, fns, iterable, executor=None):
+        """Пакетне обчислення: аргументи групуються за вузлами, кожен вузол обробляє свою частину"""
+        calls = [args if isinstance(args, tuple) else (args,) for args in iterable]
+        suffixes = [fns[0].make_suffix(*args) for args in calls]
+        groups = {}
+        for position, suffix in enumerate(suffixes):
+            groups.setdefault(self.ring.node(suffix), []).append(position)
+        results = [None] * len(calls)
+        for index, positions in groups.items():
+            found = self.shards[index].map_suffixes(fns[index], [calls[position] for position in positions],
+                                                    [suffixes[position] for position in positions], executor)
+            for position, result in zip(positions, found):
+                results[position] = result
+        return results
+
+    @staticmethod
+    def function_stats(fns):
+        totals = Counter()
+        for fn in fns:
+            totals.update(fn.stats.snapshot())
+        calls = totals['l1_hits'] + totals['l2_hits'] + totals['misses']
+        totals['hit_ratio'] = (calls - totals['misses']) / calls if calls else 0.0
+        return dict(totals)
+
+    def clear(self):
+        for shard in self.shards:
+            shard.clear()
+
+    def shard_stats(self):
+        """Навантаження на кожен вузол: кількість записів, байти і звернення"""
+        result = {}
+        for name, shard in zip(self.ring.names, self.shards):
+            ratios = shard.hit_ratios()
+            result[name] = {'entries': shard.client.zcard(shard.lru_key),
+                            'bytes': int(shard.client.get(shard.bytes_key) or 0),
+                            'calls': ratios['l1_hits'] + ratios['l2_hits'] + ratios['misses']}
+        return result
+
+
+class AsyncMyLRU(BaseLRU):
+    """Асинхронний варіант MyLRU для корутин на основі redis.asyncio.
+
+    Ключі і формат значень збігаються з MyLRU, тому обидва варіанти можуть
+    використовувати той самий кеш. Обрізання кешу при старті - метод trim().
+    """
+
+    def __init__(self, client: redis.asyncio.Redis,
+                 max_size=2 ** 20,
+                 key_prefix='MyRedisLRU',
+                 **options):
+        super().__init__(client, max_size, key_prefix, **options)
+        self.tasks = set()
+
+    def __call__(self, func=None, *, key_func=None, codec=None, compress=_MISSING, ttl=_MISSING):
+        if func is None:
+            return lambda f: self(f, key_func=key_func, codec=codec, compress=compress, ttl=ttl)
+        fn = self.cached_function(func, key_func, codec, compress, ttl)
+
+        async def call(ttl, *args, **kwargs):
+            suffix = fn.make_suffix(*args, **kwargs)
+            self.record(fn, suffix)
+            key, data = await self.lookup(fn, suffix)
+            if data is None:
+                fn.stats.add(misses=1)
+                result = await self.compute(fn, key, ttl, *args, **kwargs)
+            else:
+                fn.stats.add(l2_hits=1)
+                fresh_until, _ = split_expiry(data)
+                if fresh_until is not None and fresh_until < time.time():
+                    await self.revalidate(fn, key, ttl, *args, **kwargs)
+                result = self.decode(data)
+            if self.flush_due():
+                await self.flush_stats()
             return result
 
+        @wraps(func)
+        async def wrapper(*args, **kwargs):
+            return await call(fn.ttl, *args, **kwargs)
+
+        wrapper.with_ttl = lambda call_ttl: lambda *args, **kwargs: call(call_ttl, *args, **kwargs)
+        wrapper.stats = fn.stats.snapshot
+        wrapper.invalidate = lambda: self.invalidate(fn)
         return wrapper
 
-    def _decorator_key(self, func: types.FunctionType, *args, **kwargs):
-        try:
-            hash_arg = tuple([hash(arg) for arg in args])
-            hash_kwargs = tuple([hash(value) for value in kwargs.values()])
-        except TypeError as err:
-            raise ArgsUnhashable()
+    async def lookup(self, fn: CachedFunction, suffix):
+        version = fn.version
+        key = fn.key(suffix)
+        data = await self.get(key, fn)
+        if data is None and fn.version != version:
+            key = fn.key(suffix)
+            data = await self.get(key, fn)
+        return key, data
+
+    async def get(self, key, fn: CachedFunction):
+        start = time.perf_counter()
+        data = await super().get(key, fn)
+        fn.stats.observe(time.perf_counter() - start)
+        if isinstance(data, list):
+            fn.version = data[0].decode()
+            return None
+        return data
+
+    async def invalidate(self, func):
+        """Робить недосяжними всі записи функції; старі записи прибирає MyLRU.cleanup()"""
+        fn = func if isinstance(func, CachedFunction) else self._function(func)
+        await self._versions_pipeline(fn).execute()
+
+    async def clear(self):
+        await self._clear_pipeline().execute()
+
+    async def add(self, key, value, fn: CachedFunction = None, ttl=None):
+        data, ttl_ms = self.prepare((fn.encode if fn else self.encode)(value), ttl)
+        if not self.fits(data):
+            return
+        start = time.perf_counter()
+        evicted = await self.store(key, data, ttl_ms, self.sketch is not None)
+        if isinstance(evicted, list):
+            evicted = await self.store(key, data, ttl_ms) if self.admitted(key, evicted) else None
+            if evicted is None and fn is not None:
+                fn.stats.add(rejections=1)
+        if fn is not None:
+            fn.stats.observe(time.perf_counter() - start)
+            if evicted is not None:
+                fn.stats.add(evictions=evicted, bytes_written=len(data))
+
+    async def compute_and_add(self, fn: CachedFunction, key, ttl, *args, **kwargs):
+        start = time.perf_counter()
+        result = await fn.func(*args, **kwargs)
+        fn.stats.add(compute_seconds=time.perf_counter() - start)
+        await self.add(key, result, fn, ttl)
+        return result
+
+    async def compute(self, fn: CachedFunction, key, ttl, *args, **kwargs):
+        """Асинхронний аналог MyLRU.compute, повертає лише значення"""
+        if not self.single_flight:
+            return await self.compute_and_add(fn, key, ttl, *args, **kwargs)
+
+        deadline = time.monotonic() + self.wait_timeout
+        lock_key, token, lock_ms = self._lock(key)
+        while True:
+            if await self.client.set(lock_key, token, nx=True, px=lock_ms):
+                try:
+                    data = await self.get(key, fn)
+                    if data is not None:
+                        return self.decode(data)
+                    return await self.compute_and_add(fn, key, ttl, *args, **kwargs)
+                finally:
+                    await self.release_script(keys=[lock_key], args=[token])
+
+            while await self.client.exists(lock_key):
+                if time.monotonic() > deadline:
+                    return await self.compute_and_add(fn, key, ttl, *args, **kwargs)
+                await asyncio.sleep(self.poll_interval)
+            data = await self.get(key, fn)
+            if data is not None:
+                return self.decode(data)
+
+    async def revalidate(self, fn: CachedFunction, key, ttl, *args, **kwargs):
+        """Запускає фонове оновлення застарілого значення окремою задачею"""
+        lock_key, token, lock_ms = self._lock(key)
+        if not await self.client.set(lock_key, token, nx=True, px=lock_ms):
+            return
+
+        async def refresh():
+            try:
+                await self.compute_and_add(fn, key, ttl, *args, **kwargs)
+            finally:
+                await self.release_script(keys=[lock_key], args=[token])
 
-        return f'{self.key_prefix}:{func.__module__}:{func.__qualname__}{hash_arg}:{hash_kwargs}'
+        # Посилання на задачу зберігається, щоб її не прибрав збирач сміття до завершення
+        task = asyncio.create_task(refresh())
+        self.tasks.add(task)
+        task.add_done_callback(self.tasks.discard)
 
-    def move_up(self, key):
-        self.client.lrem('CashList', 1, key)
-        self.client.lpush('CashList', key)
+    async def flush_stats(self):
+        await self._flush_pipeline().execute()
 
-    def add(self, key, value):
-        value = pickle.dumps(value)
-        self.client.set(key, value)
-        self.client.lpush('CashList', key)
-        if self.client.llen('CashList') > self.max_size:
-            key = self.client.rpop('CashList')
-            self.client.delete(key)
+    async def trim(self, chunk_size=10_000):
+        """Видаляє найдавніше використані записи понад max_size і max_bytes пакетами по chunk_size"""
+        size, evicted = await self.client.zcard(self.lru_key), 0
+        while True:
+            target = max(self.max_size, size - chunk_size)
+            args = self._script_args()
+            args[1] = target
+            count = await self.trim_script(keys=self._script_keys(self.lru_key), args=args)
+            evicted, size = evicted + count, size - count
+            if target == self.max_size:
+                return evicted
 
 
 if __name__ == '__main__':